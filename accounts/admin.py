@@ -2,29 +2,21 @@ from django.contrib import admin
 from django.shortcuts import redirect
 from django.urls import reverse
 
-from accounts.models import AccessToken, RefreshToken
+from accounts.models import Credential
 from accounts.settings import accounts_settings
 
 
-class AccessTokenAdmin(admin.ModelAdmin):
+class CredentialAdmin(admin.ModelAdmin):
     """
-    Custom ModelAdmin for Access Tokens
+    Custom ModelAdmin for Credentials
     """
 
-    list_display = ("token", "user", "expires_at")
-
-
-class RefreshTokenAdmin(admin.ModelAdmin):
-    """
-    Custom ModelAdmin for Refresh Tokens
-    """
-
-    list_display = ("token", "user")
+    list_display = ("user", "access_token", "expires_at", "refresh_token")
+    exclude = ("access_token_hash",)
 
 
 # Register models to admin site
-admin.site.register(AccessToken, AccessTokenAdmin)
-admin.site.register(RefreshToken, RefreshTokenAdmin)
+admin.site.register(Credential, CredentialAdmin)
 
 
 class LabsAdminSite(admin.AdminSite):
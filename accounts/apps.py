@@ -4,3 +4,48 @@ from django.apps import AppConfig
 class AccountsConfig(AppConfig):
     name = "accounts"
     verbose_name = "Penn Labs Account Handler"
+
+    def ready(self):
+        from django.contrib.auth import get_user_model
+        from django.contrib.auth.models import Group
+        from django.db.models.signals import (
+            m2m_changed,
+            post_delete,
+            post_save,
+            pre_delete,
+        )
+
+        from accounts.cache import (
+            invalidate_group_users,
+            invalidate_user,
+            invalidate_user_groups,
+        )
+        from accounts.groups import invalidate_group
+        from accounts.settings import accounts_settings
+
+        # Keep the group cache in sync with renamed and deleted groups
+        post_save.connect(
+            invalidate_group, sender=Group, dispatch_uid="accounts.groups"
+        )
+        post_delete.connect(
+            invalidate_group, sender=Group, dispatch_uid="accounts.groups"
+        )
+
+        # Remove changed users from the user cache
+        User = get_user_model()
+        post_save.connect(invalidate_user, sender=User, dispatch_uid="accounts.user")
+        post_delete.connect(invalidate_user, sender=User, dispatch_uid="accounts.user")
+        m2m_changed.connect(
+            invalidate_user_groups,
+            sender=User.groups.through,
+            dispatch_uid="accounts.user_groups",
+        )
+        pre_delete.connect(
+            invalidate_group_users, sender=Group, dispatch_uid="accounts.group_users"
+        )
+
+        # Refresh expiring access tokens in the background if enabled
+        if accounts_settings.TOKEN_REFRESHER:
+            from accounts.refresher import token_refresher
+
+            token_refresher.start()
@@ -1,14 +1,72 @@
+import copy
+import inspect
+
+import django
 import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib import auth
 from django.contrib.auth import get_user_model
+from django.contrib.auth.signals import user_login_failed
+from django.core.exceptions import ImproperlyConfigured, PermissionDenied
+from django.utils import timezone
 from rest_framework import authentication, exceptions
+from rest_framework.throttling import BaseThrottle
 
+from accounts.cache import failed_authentications, introspection_cache
+from accounts.platform import async_platform_client, httpx, platform_client
 from accounts.settings import accounts_settings
-from identity.identity import get_validated_claims
+from accounts.singleflight import AsyncSingleFlight, SingleFlight
+from accounts.utils import for_write, get_read_database, hash_token
+from identity.identity import container, get_validated_claims, looks_like_jwt
 
 
 User = get_user_model()
 
+# Introspection statuses that mean Platform rejected a token. Any other error,
+# such as 429 or 503, means the token couldn't be checked, so it isn't cached as
+# rejected or counted as a failed authentication.
+REJECTED_STATUSES = {400, 401, 403}
+
+# Concurrent authentications with the same token share a single introspection
+introspection_flight = SingleFlight()
+async_introspection_flight = AsyncSingleFlight()
+
+
+async def aauthenticate(request=None, **credentials):
+    """
+    Authenticate with the configured authentication backends like
+    django.contrib.auth.aauthenticate, awaiting a backend's aauthenticate method if
+    it has one. Django only does this itself starting with 5.2.
+    """
+    if django.VERSION >= (5, 2):
+        return await auth.aauthenticate(request, **credentials)
+    for backend_path in settings.AUTHENTICATION_BACKENDS:
+        backend = auth.load_backend(backend_path)
+        try:
+            inspect.signature(backend.authenticate).bind(request, **credentials)
+        except TypeError:
+            continue
+        try:
+            if hasattr(backend, "aauthenticate"):
+                user = await backend.aauthenticate(request, **credentials)
+            else:
+                user = await sync_to_async(backend.authenticate)(request, **credentials)
+        except PermissionDenied:
+            break
+        if user is None:
+            continue
+        user.backend = backend_path
+        return user
+
+    await user_login_failed.asend(
+        sender=auth.__name__, credentials=credentials, request=request
+    )
+
+
+class InvalidToken(exceptions.AuthenticationFailed):
+    default_detail = "Invalid access token."
+
 
 class PlatformAuthentication(authentication.BaseAuthentication):
     """
@@ -24,6 +82,77 @@ class PlatformAuthentication(authentication.BaseAuthentication):
 
     # DLA receives an incoming authentication request (from another product DLA) and processes it
     def authenticate(self, request):
+        token = self.get_token(request)
+        if token is None:
+            return None
+        ident = BaseThrottle().get_ident(request)
+        if failed_authentications.is_limited(ident):
+            raise exceptions.Throttled()
+        try:
+            return self.authenticate_credentials(token)
+        except InvalidToken:
+            failed_authentications.record(ident)
+            raise
+
+    def authenticate_credentials(self, token):
+        if self.verify_locally(token):
+            # Skip introspection for Platform JWTs that can be verified with the JWKS
+            if get_validated_claims(token):
+                return (None, None)
+            raise InvalidToken()
+        if accounts_settings.LOCAL_TOKEN_LOOKUP:
+            user = for_write(self.get_token_users(token).first())
+            if user is not None and user.is_active:
+                return (user, None)
+        if not accounts_settings.INTROSPECTION_SINGLE_FLIGHT:
+            return self.authenticate_token(token)
+        result, shared = introspection_flight.do(
+            hash_token(token), lambda: self.authenticate_token(token)
+        )
+        if shared and result[0] is not None:
+            # Give each request its own user instance
+            return (copy.copy(result[0]), result[1])
+        return result
+
+    def authenticate_token(self, token):
+        """
+        Authenticate an access token by introspecting it with Platform
+        """
+        try:
+            json = None
+            if not introspection_cache.is_rejected(token):
+                json = introspection_cache.get(token) or self.introspect(token)
+            if json is None:  # Access token is invalid
+                # Allow access to a validated Platform JWT
+                if get_validated_claims(token):
+                    return (None, None)
+                raise InvalidToken()
+            user_props = json["user"]
+            user = auth.authenticate(remote_user=user_props, tokens=False)
+            if user:  # User authenticated successfully
+                return (user, None)
+            else:  # Error occurred
+                raise exceptions.AuthenticationFailed("Invalid User.")
+        except requests.exceptions.HTTPError:  # Platform couldn't check the token
+            # Allow access to a validated Platform JWT
+            if get_validated_claims(token):
+                return (None, None)
+            raise exceptions.AuthenticationFailed(
+                "Could not verify access token. Error connecting to platform."
+            )
+        except requests.exceptions.RequestException:  # Can't connect to platform
+            # Throw a 403 because we can't verify the incoming access token so we
+            # treat it as invalid. Ideally platform will never go down, so this
+            # should never happen.
+            raise exceptions.AuthenticationFailed(
+                "Could not verify access token. Error connecting to platform."
+            )
+
+    def get_token(self, request):
+        """
+        Extract the access token from the Authorization header.
+        Returns None if the request does not use this authentication scheme.
+        """
         authorization = request.META.get("HTTP_AUTHORIZATION", "").split()
         if not authorization or authorization[0] != self.keyword:
             return None
@@ -33,34 +162,158 @@ class PlatformAuthentication(authentication.BaseAuthentication):
         elif len(authorization) > 2:
             msg = "Invalid token header. Token string should not contain spaces."
             raise exceptions.AuthenticationFailed(msg)
-        token = authorization[1]
-        body = {"token": token}
-        headers = {"Authorization": f"Bearer {token}"}
-        try:
-            platform_request = requests.post(
-                url=accounts_settings.PLATFORM_URL + "/accounts/introspect/",
-                headers=headers,
-                data=body,
+        return authorization[1]
+
+    def get_token_users(self, token):
+        """
+        Return a queryset of the user whose unexpired access token, as stored by
+        TokenView or CallbackView, matches a token. Uses a single indexed query.
+        """
+        return (
+            User._default_manager.using(get_read_database(User))
+            .select_related("platformprofile")
+            .filter(
+                credential__access_token_hash=hash_token(token),
+                credential__expires_at__gt=timezone.now(),
             )
-            if platform_request.status_code != 200:  # Access token is invalid
+        )
+
+    def verify_locally(self, token):
+        """
+        Determine if a token should be verified locally as a Platform JWT
+        instead of being introspected by Platform
+        """
+        return (
+            accounts_settings.VERIFY_JWT_LOCALLY
+            and container.platform_jwks is not None
+            and looks_like_jwt(token)
+        )
+
+    def introspect(self, token):
+        """
+        Introspect an access token with Platform, caching the response.
+        Returns None if Platform rejects the token, and raises an HTTP error if
+        Platform couldn't check it.
+        """
+        with introspection_cache.lock(token) as json:
+            if json is not None:  # Introspected by another process
+                return json
+            platform_request = platform_client.introspect(token)
+            if platform_request.status_code in REJECTED_STATUSES:
+                introspection_cache.reject(token)
+                return None
+            if platform_request.status_code != 200:
+                raise requests.exceptions.HTTPError(
+                    f"Platform returned {platform_request.status_code}",
+                    response=platform_request,
+                )
+            json = platform_request.json()
+            introspection_cache.set(token, json)
+            return json
+
+    def authenticate_header(self, request):
+        return self.keyword
+
+
+class AsyncPlatformAuthentication(PlatformAuthentication):
+    """
+    Async version of PlatformAuthentication for ASGI deployments using async
+    views (such as adrf). Platform is called with a non-blocking HTTP client and
+    users are synced with LabsUserBackend.aauthenticate, so no thread is tied up
+    while a token is introspected.
+
+    Requires httpx (`pip install django-labs-accounts[async]`).
+    """
+
+    def __init__(self):
+        if httpx is None:
+            raise ImproperlyConfigured("AsyncPlatformAuthentication requires httpx")
+
+    async def authenticate(self, request):
+        token = self.get_token(request)
+        if token is None:
+            return None
+        ident = BaseThrottle().get_ident(request)
+        if await failed_authentications.ais_limited(ident):
+            raise exceptions.Throttled()
+        try:
+            return await self.authenticate_credentials(token)
+        except InvalidToken:
+            await failed_authentications.arecord(ident)
+            raise
+
+    async def authenticate_credentials(self, token):
+        if self.verify_locally(token):
+            # Skip introspection for Platform JWTs that can be verified with the JWKS
+            if get_validated_claims(token):
+                return (None, None)
+            raise InvalidToken()
+        if accounts_settings.LOCAL_TOKEN_LOOKUP:
+            user = for_write(await self.get_token_users(token).afirst())
+            if user is not None and user.is_active:
+                return (user, None)
+        if not accounts_settings.INTROSPECTION_SINGLE_FLIGHT:
+            return await self.authenticate_token(token)
+        result, shared = await async_introspection_flight.do(
+            hash_token(token), lambda: self.authenticate_token(token)
+        )
+        if shared and result[0] is not None:
+            # Give each request its own user instance
+            return (copy.copy(result[0]), result[1])
+        return result
+
+    async def authenticate_token(self, token):
+        """
+        Authenticate an access token by introspecting it with Platform
+        """
+        try:
+            json = None
+            if not await introspection_cache.ais_rejected(token):
+                json = await introspection_cache.aget(token)
+                if json is None:
+                    json = await self.introspect(token)
+            if json is None:  # Access token is invalid
                 # Allow access to a validated Platform JWT
                 if get_validated_claims(token):
                     return (None, None)
-                raise exceptions.AuthenticationFailed("Invalid access token.")
-            json = platform_request.json()
+                raise InvalidToken()
             user_props = json["user"]
-            user = auth.authenticate(remote_user=user_props, tokens=False)
+            user = await aauthenticate(remote_user=user_props, tokens=False)
             if user:  # User authenticated successfully
                 return (user, None)
             else:  # Error occurred
                 raise exceptions.AuthenticationFailed("Invalid User.")
-        except requests.exceptions.RequestException:  # Can't connect to platform
-            # Throw a 403 because we can't verify the incoming access token so we
-            # treat it as invalid. Ideally platform will never go down, so this
-            # should never happen.
+        except httpx.HTTPStatusError:  # Platform couldn't check the token
+            # Allow access to a validated Platform JWT
+            if get_validated_claims(token):
+                return (None, None)
+            raise exceptions.AuthenticationFailed(
+                "Could not verify access token. Error connecting to platform."
+            )
+        except httpx.HTTPError:  # Can't connect to platform
             raise exceptions.AuthenticationFailed(
                 "Could not verify access token. Error connecting to platform."
             )
 
-    def authenticate_header(self, request):
-        return self.keyword
+    async def introspect(self, token):
+        """
+        Introspect an access token with Platform, caching the response.
+        Returns None if Platform rejects the token, and raises an HTTP error if
+        Platform couldn't check it.
+        """
+        async with introspection_cache.alock(token) as json:
+            if json is not None:  # Introspected by another process
+                return json
+            platform_request = await async_platform_client.introspect(token)
+            if platform_request.status_code in REJECTED_STATUSES:
+                await introspection_cache.areject(token)
+                return None
+            if platform_request.status_code != 200:
+                raise httpx.HTTPStatusError(
+                    f"Platform returned {platform_request.status_code}",
+                    request=platform_request.request,
+                    response=platform_request,
+                )
+            json = platform_request.json()
+            await introspection_cache.aset(token, json)
+            return json
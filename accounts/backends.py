@@ -1,12 +1,46 @@
+import hashlib
+import json
 from datetime import timedelta
 
+from asgiref.sync import sync_to_async
 from django.contrib.auth import get_user_model
 from django.contrib.auth.backends import RemoteUserBackend
-from django.contrib.auth.models import Group
+from django.db import IntegrityError, transaction
 from django.utils import timezone
 
-from accounts.models import AccessToken, RefreshToken
+from accounts.cache import user_cache
+from accounts.groups import group_cache
+from accounts.models import Credential, PlatformProfile
 from accounts.settings import accounts_settings
+from accounts.utils import (
+    for_write,
+    get_read_database,
+    get_write_database,
+    hash_token,
+    upsert,
+)
+from accounts.writebehind import write_behind
+
+
+USER_FIELDS = ["first_name", "last_name", "username", "email"]
+ADMIN_FIELDS = ["is_staff", "is_superuser"]
+# How often an unchanged user's PlatformProfile.last_seen is updated
+LAST_SEEN_INTERVAL = timedelta(days=1)
+
+
+def get_fingerprint(remote_user):
+    """
+    Hash the parts of a Platform profile that are synced to a user
+    """
+    profile = {
+        "fields": {field: remote_user[field] for field in USER_FIELDS},
+        "user_permissions": sorted(remote_user["user_permissions"]),
+        "groups": sorted(remote_user["groups"]),
+        "admin_permission": accounts_settings.ADMIN_PERMISSION,
+    }
+    return hashlib.sha256(
+        json.dumps(profile, sort_keys=True).encode("utf-8")
+    ).hexdigest()
 
 
 class LabsUserBackend(RemoteUserBackend):
@@ -17,57 +51,283 @@ class LabsUserBackend(RemoteUserBackend):
         """
         if not remote_user:
             return
+        fingerprint = get_fingerprint(remote_user)
+        user, created = self.find_user(remote_user), False
+
+        # Writes are skipped entirely for existing users with an unchanged
+        # Platform profile who were seen recently
+        if user is None or tokens or self.needs_write(user, fingerprint):
+            user, created = self.write_user(
+                request, user, remote_user, tokens, fingerprint
+            )
+
+        self.post_authenticate(user, created, remote_user)
+        return user if self.user_can_authenticate(user) else None
+
+    async def aauthenticate(self, request, remote_user, tokens=True):
+        """
+        Async version of authenticate. The user is read with the async ORM, so
+        existing users with an unchanged Platform profile are authenticated
+        without leaving the event loop. Any writes run write_user in a thread by
+        design: the async ORM can't run queries in a transaction, and the writes
+        need one to serialize concurrent logins and to roll back a failed sync.
+        """
+        if not remote_user:
+            return
+        fingerprint = get_fingerprint(remote_user)
+        user, created = await self.afind_user(remote_user), False
+
+        if user is None or tokens or self.needs_write(user, fingerprint):
+            user, created = await sync_to_async(self.write_user)(
+                request, user, remote_user, tokens, fingerprint
+            )
+
+        await self.apost_authenticate(user, created, remote_user)
+        return user if self.user_can_authenticate(user) else None
+
+    def write_user(self, request, user, remote_user, tokens, fingerprint):
+        """
+        Provision or sync a user and their tokens in one short transaction.
+        Returns the user and a boolean that is true if the user was created.
+        """
+        created = False
+        with transaction.atomic(using=get_write_database(get_user_model())):
+            if user is None:
+                user, created = self.provision_user(remote_user)
+
+            if created:
+                try:
+                    user = self.configure_user(request, user)
+                except TypeError:
+                    user = self.configure_user(user)
+
+            #  Update Access and Refresh Token if desired
+            if tokens:
+                upsert(Credential, "user", **self.get_credential(user, remote_user))
+
+            # Only write the user if their Platform profile changed since the
+            # last sync. The profile is written first so that concurrent syncs
+            # of the same user wait on its row lock.
+            if self.needs_sync(user, created, fingerprint):
+                profile = {
+                    **self.get_profile(user, remote_user, fingerprint),
+                    "last_seen": timezone.now(),
+                }
+                if created or not write_behind.enabled:
+                    upsert(PlatformProfile, "user", **profile)
+                    self.sync_user(user, created, remote_user)
+                    # Upserts don't send signals, so remove the user from the cache
+                    # in case only their Platform permissions changed
+                    user_cache.delete(user.pk)
+                else:
+                    self.defer_sync(user, remote_user, profile)
+                user.platformprofile = PlatformProfile(**profile)
+            elif self.needs_seen(user):
+                user.platformprofile.last_seen = timezone.now()
+                PlatformProfile.objects.filter(user=user).update(
+                    last_seen=user.platformprofile.last_seen
+                )
+        return user, created
+
+    def get_user(self, user_id):
+        """
+        Load a user for session authentication with their Platform profile, from
+        the USER_CACHE if enabled
+        """
+        user = user_cache.get(user_id)
+        if user is None:
+            # The READ_DATABASE may not have a new user yet, so check the primary
+            User = get_user_model()
+            databases = [get_read_database(User), get_write_database(User)]
+            for using in dict.fromkeys(databases):
+                users = self.get_users(using)
+                if user_cache.enabled:
+                    users = users.prefetch_related("groups")
+                if (user := users.filter(pk=user_id).first()) is not None:
+                    break
+            else:
+                return None
+            for_write(user)
+            user_cache.set(user)
+        return user if self.user_can_authenticate(user) else None
+
+    def get_users(self, using=None):
+        """
+        Return a queryset of users with their Platform profile, read from the
+        READ_DATABASE unless another database is given
+        """
         User = get_user_model()
-        user, created = User.objects.get_or_create(
-            id=remote_user["pennid"], defaults={"username": remote_user["username"]}
+        return User._default_manager.using(
+            using or get_read_database(User)
+        ).select_related("platformprofile")
+
+    def find_user(self, remote_user, using=None):
+        """
+        Return the existing user for a Platform profile, or None. The user is
+        read from the READ_DATABASE, but saved to the primary.
+        """
+        return for_write(self.get_users(using).filter(id=remote_user["pennid"]).first())
+
+    async def afind_user(self, remote_user, using=None):
+        users = self.get_users(using).filter(id=remote_user["pennid"])
+        return for_write(await users.afirst())
+
+    def provision_user(self, remote_user):
+        """
+        Create the user for a Platform profile. Safe to call concurrently for the
+        same user: the user is inserted with INSERT ... ON CONFLICT DO NOTHING and
+        exactly one caller claims the new user by giving them an unusable password.
+        Returns the user and a boolean that is true if this call claimed the user.
+        """
+        user = self.new_user(remote_user)
+        User = type(user)
+        User.objects.bulk_create([user], ignore_conflicts=True)
+        user.set_unusable_password()
+        if User.objects.filter(pk=user.pk, password="").update(password=user.password):
+            return user, True
+        using = get_write_database(User)
+        if (user := self.find_user(remote_user, using)) is None:
+            # Conflicted with a different user, such as on username
+            raise IntegrityError(f"Could not create user {remote_user['pennid']}")
+        return user, False
+
+    def new_user(self, remote_user):
+        # An empty password marks a user that hasn't been claimed yet
+        return get_user_model()(
+            id=remote_user["pennid"], username=remote_user["username"], password=""
         )
 
+    def get_credential(self, user, remote_user):
+        # Credentials are upserted without calling save, so hash the token here
+        token = remote_user["token"]
+        return {
+            "user": user,
+            "access_token": token["access_token"],
+            "access_token_hash": hash_token(token["access_token"]),
+            "expires_at": timezone.now() + timedelta(seconds=token["expires_in"]),
+            "refresh_token": token["refresh_token"],
+        }
+
+    def get_profile(self, user, remote_user, fingerprint):
+        """
+        Return the PlatformProfile fields for a user. The profile is attached to
+        the returned user so that their Platform groups and permissions can be
+        checked without a query.
+        """
+        return {
+            "user": user,
+            "fingerprint": fingerprint,
+            "groups": sorted(set(remote_user["groups"])),
+            "permissions": sorted(set(remote_user["user_permissions"])),
+        }
+
+    def needs_sync(self, user, created, fingerprint):
+        """
+        Check if a user's Platform profile changed since they were last synced
+        """
         if created:
-            user.set_unusable_password()
-            user.save()
-            try:
-                user = self.configure_user(request, user)
-            except TypeError:
-                user = self.configure_user(user)
+            return True
+        profile = getattr(user, "platformprofile", None)
+        return profile is None or profile.fingerprint != fingerprint
+
+    def needs_seen(self, user):
+        """
+        Check if an existing user's last_seen is older than LAST_SEEN_INTERVAL
+        """
+        last_seen = user.platformprofile.last_seen
+        return last_seen is None or last_seen < timezone.now() - LAST_SEEN_INTERVAL
+
+    def needs_write(self, user, fingerprint):
+        """
+        Check if authenticating an existing user writes to the database
+        """
+        return self.needs_sync(user, False, fingerprint) or self.needs_seen(user)
+
+    def update_user(self, user, remote_user):
+        """
+        Update a user's fields and admin permissions from platform without
+        saving. Returns the names of the fields that changed.
+        """
+        changed = []
 
         # Update user fields if changed
-        for field in ["first_name", "last_name", "username", "email"]:
-            if getattr(user, field) is not remote_user[field]:
+        for field in USER_FIELDS:
+            if getattr(user, field) != remote_user[field]:
                 setattr(user, field, remote_user[field])
-
-        #  Update Access and Refresh Token if desired
-        if tokens:
-            AccessToken.objects.update_or_create(
-                user=user,
-                defaults={
-                    "expires_at": timezone.now()
-                    + timedelta(seconds=remote_user["token"]["expires_in"]),
-                    "token": remote_user["token"]["access_token"],
-                },
-            )
-            RefreshToken.objects.update_or_create(
-                user=user, defaults={"token": remote_user["token"]["refresh_token"]}
-            )
+                changed.append(field)
 
         # Set or remove admin permissions
         if accounts_settings.ADMIN_PERMISSION in remote_user["user_permissions"]:
             if not user.is_staff:
                 user.is_staff = True
                 user.is_superuser = True
+                changed += ADMIN_FIELDS
         else:
             if user.is_staff:
                 user.is_staff = False
                 user.is_superuser = False
+                changed += ADMIN_FIELDS
+        return changed
+
+    def sync_user(self, user, created, remote_user):
+        """
+        Update a user's fields, admin permissions and groups from platform,
+        saving only the fields that changed.
+        """
+        changed = self.update_user(user, remote_user)
+        self.sync_groups(user, remote_user["groups"])
 
-        # First disassociates user with platform groups, then loads in new groups
-        user.groups.remove(*user.groups.filter(name__startswith="platform_"))
-        for group_name in remote_user["groups"]:
-            group, _ = Group.objects.get_or_create(name=f"platform_{group_name}")
-            user.groups.add(group)
+        if created:
+            user.save()
+        elif changed:
+            user.save(update_fields=changed)
 
-        user.save()
-        self.post_authenticate(user, created, remote_user)
-        return user if self.user_can_authenticate(user) else None
+    def defer_sync(self, user, remote_user, profile):
+        """
+        Sync an existing user with WRITE_BEHIND enabled. Admin permission changes
+        are saved right away, while the rest of the user's Platform profile is
+        queued and written once the current transaction commits.
+        """
+        if admin := [
+            field
+            for field in self.update_user(user, remote_user)
+            if field in ADMIN_FIELDS
+        ]:
+            user.save(update_fields=admin)
+        update = self.get_update(user, remote_user, profile)
+        transaction.on_commit(
+            lambda: write_behind.put(user.pk, update), using=user._state.db
+        )
+
+    def get_update(self, user, remote_user, profile):
+        """
+        Return the update queued for a user by defer_sync
+        """
+        fields = {field: remote_user[field] for field in USER_FIELDS}
+        return (self, fields, remote_user["groups"], profile)
+
+    def sync_groups(self, user, group_names):
+        """
+        Sync a user's platform groups, adding only missing memberships and
+        removing only stale ones. Runs a constant number of queries regardless
+        of how many groups a user has, and none to look up cached groups unless
+        memberships are added, when the cached groups are checked to still exist.
+        """
+        groups = group_cache.get_pks(f"platform_{name}" for name in group_names)
+        wanted = set(groups.values())
+        current = set(self.get_platform_groups(user))
+        if stale := current - wanted:
+            user.groups.remove(*stale)
+        if new := wanted - current:
+            new = group_cache.verify(
+                {name: pk for name, pk in groups.items() if pk in new}
+            )
+            user.groups.add(*new.values())
+
+    def get_platform_groups(self, user):
+        return user.groups.filter(name__startswith="platform_").values_list(
+            "pk", flat=True
+        )
 
     def post_authenticate(self, user, created, dictionary):
         """
@@ -77,3 +337,11 @@ class LabsUserBackend(RemoteUserBackend):
         By default this does nothing.
         """
         pass
+
+    async def apost_authenticate(self, user, created, dictionary):
+        """
+        Async version of post_authenticate that is run by aauthenticate.
+        By default this runs post_authenticate in a thread, so products only need
+        to override this method if their post authentication is async.
+        """
+        await sync_to_async(self.post_authenticate)(user, created, dictionary)
@@ -0,0 +1,499 @@
+import asyncio
+import json
+import threading
+import time
+import zlib
+from collections import namedtuple
+from contextlib import asynccontextmanager, contextmanager
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import transaction
+
+from accounts.settings import accounts_settings
+from accounts.utils import hash_token
+
+
+class IntrospectionCache:
+    """
+    Cache of Platform introspection responses keyed by a hash of the access token.
+    Entries live in the Django cache named by the INTROSPECTION_CACHE setting so
+    that every worker sharing that cache benefits from a hit.
+    """
+
+    prefix = "accounts:introspect:"
+    rejected_prefix = "accounts:introspect-rejected:"
+    lock_prefix = "accounts:introspect-lock:"
+    poll_interval = 0.05
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return accounts_settings.INTROSPECTION_CACHE is not None
+
+    @property
+    def locking(self):
+        return self.enabled and accounts_settings.INTROSPECTION_CACHE_LOCK
+
+    @property
+    def cache(self):
+        return caches[accounts_settings.INTROSPECTION_CACHE]
+
+    def key(self, token):
+        return self.prefix + hash_token(token)
+
+    def lock_key(self, token):
+        return self.lock_prefix + hash_token(token)
+
+    def lock_timeout(self):
+        return (
+            accounts_settings.PLATFORM_CONNECT_TIMEOUT
+            + accounts_settings.PLATFORM_READ_TIMEOUT
+        )
+
+    def timeout(self, response):
+        """
+        Number of seconds to cache a response: until the token expires or the
+        INTROSPECTION_CACHE_TTL cap is reached, whichever comes first
+        """
+        timeout = accounts_settings.INTROSPECTION_CACHE_TTL
+        if "exp" in response:
+            timeout = min(timeout, int(response["exp"] - time.time()))
+        return timeout
+
+    def record(self, response):
+        with self._lock:
+            if response is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return response
+
+    def get(self, token):
+        """
+        Return the cached introspection response for a token, or None
+        """
+        if not self.enabled:
+            return None
+        return self.record(self.cache.get(self.key(token)))
+
+    async def aget(self, token):
+        if not self.enabled:
+            return None
+        return self.record(await self.cache.aget(self.key(token)))
+
+    def set(self, token, response):
+        """
+        Cache a successful introspection response
+        """
+        if self.enabled and (timeout := self.timeout(response)) > 0:
+            self.cache.set(self.key(token), response, timeout)
+
+    async def aset(self, token, response):
+        if self.enabled and (timeout := self.timeout(response)) > 0:
+            await self.cache.aset(self.key(token), response, timeout)
+
+    @property
+    def negative_timeout(self):
+        if not self.enabled:
+            return 0
+        return accounts_settings.INTROSPECTION_NEGATIVE_CACHE_TTL
+
+    def reject(self, token):
+        """
+        Remember that Platform rejected a token
+        """
+        if self.negative_timeout > 0:
+            self.cache.set(
+                self.rejected_prefix + hash_token(token), True, self.negative_timeout
+            )
+
+    async def areject(self, token):
+        if self.negative_timeout > 0:
+            await self.cache.aset(
+                self.rejected_prefix + hash_token(token), True, self.negative_timeout
+            )
+
+    def is_rejected(self, token):
+        """
+        Check if Platform recently rejected a token
+        """
+        if self.negative_timeout <= 0:
+            return False
+        return self.cache.get(self.rejected_prefix + hash_token(token), False)
+
+    async def ais_rejected(self, token):
+        if self.negative_timeout <= 0:
+            return False
+        return await self.cache.aget(self.rejected_prefix + hash_token(token), False)
+
+    @contextmanager
+    def lock(self, token):
+        """
+        Serialize introspection of a token across every process sharing the cache.
+        Yields the response cached by another process while waiting for the lock,
+        or None if the caller should introspect the token itself.
+        """
+        if not self.locking:
+            yield None
+            return
+
+        key, lock_key = self.key(token), self.lock_key(token)
+        deadline = time.monotonic() + self.lock_timeout()
+        acquired = self.cache.add(lock_key, True, self.lock_timeout())
+        # Wait for the process holding the lock to finish introspecting
+        while not acquired and time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+            if self.cache.get(lock_key) is None or self.cache.get(key) is not None:
+                break
+        try:
+            response = self.cache.get(key)
+            if response is not None:
+                self.record(response)
+            yield response
+        finally:
+            if acquired:
+                self.cache.delete(lock_key)
+
+    @asynccontextmanager
+    async def alock(self, token):
+        if not self.locking:
+            yield None
+            return
+
+        key, lock_key = self.key(token), self.lock_key(token)
+        deadline = time.monotonic() + self.lock_timeout()
+        acquired = await self.cache.aadd(lock_key, True, self.lock_timeout())
+        while not acquired and time.monotonic() < deadline:
+            await asyncio.sleep(self.poll_interval)
+            if (
+                await self.cache.aget(lock_key) is None
+                or await self.cache.aget(key) is not None
+            ):
+                break
+        try:
+            response = await self.cache.aget(key)
+            if response is not None:
+                self.record(response)
+            yield response
+        finally:
+            if acquired:
+                await self.cache.adelete(lock_key)
+
+    def stats(self):
+        """
+        Return the hit and miss counters for this process
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+
+class FailedAuthenticationLimiter:
+    """
+    Fixed window limit on the number of rejected access tokens from a client,
+    set by the FAILED_AUTHENTICATION_RATE setting (ex. "30/min"). Counters are
+    kept in the INTROSPECTION_CACHE.
+    """
+
+    prefix = "accounts:auth-failures:"
+    durations = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+    @property
+    def enabled(self):
+        return (
+            introspection_cache.enabled
+            and accounts_settings.FAILED_AUTHENTICATION_RATE is not None
+        )
+
+    @property
+    def cache(self):
+        return introspection_cache.cache
+
+    def rate(self):
+        """
+        Parse the rate into a number of failures and a duration in seconds
+        """
+        num, period = accounts_settings.FAILED_AUTHENTICATION_RATE.split("/")
+        return int(num), self.durations[period[0]]
+
+    def is_limited(self, ident):
+        """
+        Check if a client has reached its limit of failed authentications
+        """
+        if not self.enabled:
+            return False
+        num, _ = self.rate()
+        return self.cache.get(self.prefix + ident, 0) >= num
+
+    async def ais_limited(self, ident):
+        if not self.enabled:
+            return False
+        num, _ = self.rate()
+        return await self.cache.aget(self.prefix + ident, 0) >= num
+
+    def record(self, ident):
+        """
+        Count a failed authentication for a client
+        """
+        if not self.enabled:
+            return
+        _, duration = self.rate()
+        # add() starts a new window, which expires duration seconds later
+        if not self.cache.add(self.prefix + ident, 1, duration):
+            try:
+                self.cache.incr(self.prefix + ident)
+            except ValueError:  # Window expired between add() and incr()
+                self.cache.add(self.prefix + ident, 1, duration)
+
+    async def arecord(self, ident):
+        if not self.enabled:
+            return
+        _, duration = self.rate()
+        if not await self.cache.aadd(self.prefix + ident, 1, duration):
+            try:
+                await self.cache.aincr(self.prefix + ident)
+            except ValueError:
+                await self.cache.aadd(self.prefix + ident, 1, duration)
+
+
+class UserCache:
+    """
+    Cache of users loaded by LabsUserBackend.get_user, with their groups
+    prefetched, in the Django cache named by the USER_CACHE setting. Users are
+    removed from the cache when they or their groups change (see
+    AccountsConfig.ready).
+    """
+
+    prefix = "accounts:user:"
+
+    @property
+    def enabled(self):
+        return accounts_settings.USER_CACHE is not None
+
+    @property
+    def cache(self):
+        return caches[accounts_settings.USER_CACHE]
+
+    def key(self, user_id):
+        return f"{self.prefix}{user_id}"
+
+    def get(self, user_id):
+        """
+        Return the cached user with an id, or None
+        """
+        if not self.enabled:
+            return None
+        return self.cache.get(self.key(user_id))
+
+    def set(self, user):
+        if self.enabled:
+            self.cache.set(self.key(user.pk), user, accounts_settings.USER_CACHE_TTL)
+
+    def delete(self, *user_ids):
+        """
+        Remove users from the cache once the current transaction commits, so that
+        a concurrent request can't cache them again before the change is visible
+        """
+        if self.enabled and user_ids:
+            keys = [self.key(user_id) for user_id in user_ids]
+            transaction.on_commit(lambda: self.cache.delete_many(keys))
+
+
+class CachedResponse(namedtuple("CachedResponse", "fresh_until etag headers body")):
+    """
+    A cached IPC response with its headers and zlib compressed body
+    """
+
+    __slots__ = ()
+
+    def is_fresh(self):
+        return time.time() < self.fresh_until
+
+    @property
+    def content(self):
+        return zlib.decompress(self.body)
+
+
+class IPCResponseCache:
+    """
+    Cache of successful GET responses from other products for
+    authenticated_request, in the Django cache named by the IPC_CACHE setting.
+    Responses are stored for as long as their Cache-Control header allows, and
+    stale responses with an ETag are kept for IPC_CACHE_TTL seconds so they can be
+    revalidated with If-None-Match. Entries are keyed by the user the request was
+    made for, unless the caller marks the resource as public.
+    """
+
+    prefix = "accounts:ipc:"
+    # Headers that don't describe the cached, decompressed body
+    excluded_headers = {
+        "connection",
+        "content-encoding",
+        "content-length",
+        "set-cookie",
+        "transfer-encoding",
+    }
+
+    @property
+    def enabled(self):
+        return accounts_settings.IPC_CACHE is not None
+
+    @property
+    def cache(self):
+        return caches[accounts_settings.IPC_CACHE]
+
+    def key(self, owner, url, headers):
+        """
+        Key for a request made for an owner (a user id, or None for public
+        resources) with a full URL and request headers
+        """
+        headers = sorted([name.lower(), value] for name, value in headers.items())
+        return self.prefix + hash_token(json.dumps([owner, url, headers]))
+
+    def headers(self, headers):
+        """
+        Headers of a response that apply to its cached body, with lowercase names
+        """
+        return {
+            name.lower(): value
+            for name, value in headers.items()
+            if name.lower() not in self.excluded_headers
+        }
+
+    def lifetime(self, headers, public):
+        """
+        Number of seconds a response is fresh for, capped at IPC_CACHE_TTL, or None
+        if its Cache-Control header doesn't allow it to be stored
+        """
+        directives = {}
+        for directive in headers.get("cache-control", "").split(","):
+            name, _, value = directive.strip().partition("=")
+            directives[name.lower()] = value.strip('"')
+        if "no-store" in directives or (public and "private" in directives):
+            return None
+        if "no-cache" in directives:
+            return 0
+        max_age = directives.get("max-age")
+        if public:
+            max_age = directives.get("s-maxage", max_age)
+        try:
+            return max(0, min(int(max_age), accounts_settings.IPC_CACHE_TTL))
+        except (TypeError, ValueError):
+            return 0
+
+    def entry(self, headers, public, content=None, body=None):
+        """
+        Build an entry for a response from its headers and either its content or
+        an already compressed body. Returns the entry and the number of seconds to
+        cache it for, or None if the response can't be stored.
+        """
+        headers = self.headers(headers)
+        lifetime = self.lifetime(headers, public)
+        etag = headers.get("etag")
+        if lifetime is None or not (lifetime or etag):
+            return None
+        if body is None:
+            body = zlib.compress(content)
+        if len(body) > accounts_settings.IPC_CACHE_MAX_SIZE:
+            return None
+        entry = CachedResponse(time.time() + lifetime, etag, headers, body)
+        return entry, accounts_settings.IPC_CACHE_TTL if etag else lifetime
+
+    def merge(self, entry, headers):
+        """
+        Combine a stale entry with the headers of a 304 response revalidating it
+        """
+        headers = {**entry.headers, **self.headers(headers)}
+        return CachedResponse(0, headers.get("etag"), headers, entry.body)
+
+    def get(self, key):
+        """
+        Return the cached entry for a key, or None
+        """
+        if key is None:
+            return None
+        return self.cache.get(key)
+
+    async def aget(self, key):
+        if key is None:
+            return None
+        return await self.cache.aget(key)
+
+    def set(self, key, headers, public, content=None, body=None):
+        """
+        Cache a successful response if its headers allow it. Returns the new
+        entry, or None if it wasn't stored.
+        """
+        stored = self.entry(headers, public, content, body)
+        if stored is None:
+            self.cache.delete(key)
+            return None
+        self.cache.set(key, *stored)
+        return stored[0]
+
+    async def aset(self, key, headers, public, content=None, body=None):
+        stored = self.entry(headers, public, content, body)
+        if stored is None:
+            await self.cache.adelete(key)
+            return None
+        await self.cache.aset(key, *stored)
+        return stored[0]
+
+    def revalidate(self, key, entry, headers, public):
+        """
+        Refresh a stale entry with the headers of a 304 response. Returns the
+        updated entry, whether or not it could be stored again.
+        """
+        merged = self.merge(entry, headers)
+        return self.set(key, merged.headers, public, body=merged.body) or merged
+
+    async def arevalidate(self, key, entry, headers, public):
+        merged = self.merge(entry, headers)
+        return await self.aset(key, merged.headers, public, body=merged.body) or merged
+
+
+def invalidate_user(sender, instance, **kwargs):
+    """
+    Signal receiver that removes a saved or deleted user from the user cache
+    """
+    user_cache.delete(instance.pk)
+
+
+def invalidate_user_groups(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Signal receiver that removes users from the user cache when their groups change
+    """
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            user_cache.delete(instance.pk)
+    elif action == "pre_clear":
+        # Clearing a group's users doesn't give their ids, so collect them first
+        invalidate_group_users(sender, instance)
+    elif action in ("post_add", "post_remove") and pk_set:
+        user_cache.delete(*pk_set)
+
+
+def invalidate_group_users(sender, instance, **kwargs):
+    """
+    Signal receiver that removes a group's users from the user cache before the
+    group is deleted or cleared. Deleting a group removes its memberships without
+    sending m2m_changed.
+    """
+    if user_cache.enabled:
+        users = get_user_model()._default_manager.filter(groups=instance)
+        user_cache.delete(*users.values_list("pk", flat=True))
+
+
+introspection_cache = IntrospectionCache()
+failed_authentications = FailedAuthenticationLimiter()
+user_cache = UserCache()
+ipc_cache = IPCResponseCache()
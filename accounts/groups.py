@@ -0,0 +1,113 @@
+import threading
+
+from django.contrib.auth.models import Group
+from django.db import transaction
+
+
+def get_or_create_groups(Group, names):
+    """
+    Return a dictionary of group name to primary key, creating any groups that
+    don't exist yet. Runs at most three queries regardless of the number of names.
+    """
+    names = set(names)
+    groups = dict(Group.objects.filter(name__in=names).values_list("name", "pk"))
+    if missing := names - groups.keys():
+        Group.objects.bulk_create(
+            [Group(name=name) for name in missing], ignore_conflicts=True
+        )
+        # ignore_conflicts doesn't set primary keys, so fetch the new groups
+        groups.update(Group.objects.filter(name__in=missing).values_list("name", "pk"))
+    return groups
+
+
+class GroupCache:
+    """
+    Process-local cache of platform group names to primary keys so that syncing a
+    user's groups doesn't look up groups that have been seen before. Every platform
+    group is loaded on first use, and groups are removed from the cache when they
+    are renamed or deleted (see AccountsConfig.ready).
+
+    Entries are only stored once the transaction that read them commits, so a
+    rolled back group is never cached.
+    """
+
+    prefix = "platform_"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pks = {}
+        self._warm = False
+
+    def get_pks(self, names):
+        """
+        Return a dictionary of group name to primary key for the given group names,
+        creating any groups that don't exist yet
+        """
+        names = set(names)
+        with self._lock:
+            warm = self._warm
+            groups = {name: self._pks[name] for name in names if name in self._pks}
+        if not warm:
+            pks = dict(
+                Group.objects.filter(name__startswith=self.prefix).values_list(
+                    "name", "pk"
+                )
+            )
+            self.store(pks, warm=True)
+            groups = {name: pks[name] for name in names if name in pks}
+        if missing := names - groups.keys():
+            pks = get_or_create_groups(Group, missing)
+            self.store(pks)
+            groups.update(pks)
+        return groups
+
+    def verify(self, groups):
+        """
+        Check that groups from the cache still exist with the same names, since a
+        group renamed or deleted by another process is only removed from that
+        process's cache. Returns the groups, with any that changed looked up
+        again and recreated if needed.
+        """
+        names = dict(
+            Group.objects.filter(pk__in=groups.values()).values_list("pk", "name")
+        )
+        if changed := {name for name, pk in groups.items() if names.get(pk) != name}:
+            for name in changed:
+                self.invalidate(groups[name])
+            pks = get_or_create_groups(Group, changed)
+            self.store(pks)
+            groups = {**groups, **pks}
+        return groups
+
+    def store(self, pks, warm=False):
+        def store():
+            with self._lock:
+                self._pks.update(pks)
+                self._warm = self._warm or warm
+
+        transaction.on_commit(store)
+
+    def invalidate(self, pk):
+        """
+        Remove a group from the cache
+        """
+        with self._lock:
+            self._pks = {
+                name: value for name, value in self._pks.items() if value != pk
+            }
+
+    def clear(self):
+        with self._lock:
+            self._pks = {}
+            self._warm = False
+
+
+group_cache = GroupCache()
+
+
+def invalidate_group(sender, instance, created=False, **kwargs):
+    """
+    Signal receiver that removes a renamed or deleted group from the group cache
+    """
+    if not created:
+        group_cache.invalidate(instance.pk)
@@ -1,9 +1,23 @@
+import asyncio
 from datetime import timedelta
 
 import requests
+from asgiref.sync import sync_to_async
+from django.db import transaction
 from django.utils import timezone
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
 
+from accounts.cache import ipc_cache
+from accounts.models import Credential
+from accounts.platform import async_ipc_client, httpx, ipc_sessions, platform_client
 from accounts.settings import accounts_settings
+from accounts.singleflight import SingleFlight
+from accounts.utils import get_read_database, get_write_database
+
+
+# Concurrent refreshes of the same user's access token share a single refresh
+refresh_flight = SingleFlight()
 
 
 # IPC on behalf of a user for when a user in a product wants to use an
@@ -26,49 +40,284 @@ def authenticated_request(
     verify=None,
     cert=None,
     json=None,
+    cache="private",
 ):
     """
     Helper method to make an authenticated request using the user's access token
     NOTE be ABSOLUTELY sure you only make a request to Penn Labs products, otherwise
     you will expose user's access tokens to the URL you provide and bad things will
     happen
+
+    Requests are sent through a pooled session for the target host, and use
+    IPC_CONNECT_TIMEOUT and IPC_READ_TIMEOUT unless a timeout is given. If the
+    product rejects the access token with a 401, the token is refreshed and the
+    request is retried once.
+
+    If IPC_CACHE is set, GET requests without a body are cached as allowed by
+    the response's Cache-Control and ETag headers. Cached responses are only
+    returned for the same user, unless `cache` is "public" for resources that are
+    the same for every user. Pass `cache=None` to skip the cache.
+    """
+
+    key = None
+    # Only GET requests without a body, cookies or auth are cached
+    uncacheable = any(arg is not None for arg in [data, files, json, auth, cookies])
+    if (method or "").upper() == "GET" and not uncacheable and not stream:
+        full_url = requests.Request(method, url, params=params).prepare().url
+        key = _cache_key(user, cache, full_url, headers)
+    entry = ipc_cache.get(key)
+    if entry is not None and entry.is_fresh():
+        return _cached_response(entry, url)
+
+    if not _check_token(user):
+        return _forbidden()
+    headers = {**(headers or {}), **_conditional_headers(entry)}
+
+    # Only retry requests whose body can be sent again
+    retry = files is None and not hasattr(data, "read")
+    session = ipc_sessions.get(url)
+    while True:
+        token = user.credential.access_token
+        response = session.request(
+            method=method,
+            url=url,
+            params=params,
+            data=data,
+            headers={**headers, "Authorization": f"Bearer {token}"},
+            cookies=cookies,
+            files=files,
+            auth=auth,
+            timeout=ipc_sessions.timeout if timeout is None else timeout,
+            allow_redirects=allow_redirects,
+            proxies=proxies,
+            hooks=hooks,
+            stream=stream,
+            verify=verify,
+            cert=cert,
+            json=json,
+        )
+        if response.status_code != 401 or not retry:
+            break
+        retry = False
+        response.close()
+        # Refresh the rejected token unless another request already replaced it
+        if not _refresh_credential(
+            user.credential, lambda credential: credential.access_token == token
+        ):
+            return _forbidden()
+
+    if key is None:
+        return response
+    public = cache == "public"
+    if response.status_code == 304 and entry is not None:
+        response.close()
+        return _cached_response(
+            ipc_cache.revalidate(key, entry, response.headers, public), url
+        )
+    if response.status_code == 200:
+        ipc_cache.set(key, response.headers, public, content=response.content)
+    return response
+
+
+async def aauthenticated_request(user, method, url, **kwargs):
+    """
+    Async version of authenticated_request. Keyword arguments are passed to
+    httpx.AsyncClient.request and an httpx.Response is returned. The same NOTE
+    about only making requests to Penn Labs products applies.
+
+    Requests are sent through a client shared by the event loop, and failed
+    connections are retried IPC_RETRIES times. GET requests are cached like in
+    authenticated_request, with the same `cache` argument. Requires httpx.
     """
+    [response] = await aauthenticated_requests(user, [(method, url, kwargs)])
+    if isinstance(response, BaseException):
+        raise response
+    return response
 
-    # Access token is expired. Try to refresh access token
-    if user.accesstoken.expires_at < timezone.now():
-        if not _refresh_access_token(user):
-            # Couldn't update the user's access token. Return a response with a 403 status code
-            # as if the user didn't have access to the requested resource
-            response = requests.models.Response
-            response.status_code = 403
-            return response
-
-    # Update Headers
-    headers = {} if headers is None else headers
-    headers["Authorization"] = f"Bearer {user.accesstoken.token}"
-
-    # Make the request
-    # We're only using a session to provide an easy wrapper to define the http method
-    # GET, POST, etc in the method call.
-    s = requests.Session()
-    return s.request(
-        method=method,
-        url=url,
-        params=params,
-        data=data,
-        headers=headers,
-        cookies=cookies,
-        files=files,
-        auth=None,
-        timeout=None,
-        allow_redirects=allow_redirects,
-        proxies=proxies,
-        hooks=hooks,
-        stream=stream,
-        verify=verify,
-        cert=cert,
-        json=json,
+
+async def aauthenticated_requests(user, calls):
+    """
+    Make several authenticated requests concurrently. `calls` is a list of
+    (method, url, kwargs) tuples, where kwargs are passed to
+    aauthenticated_request. The user's access token is checked, and refreshed if
+    needed, once for all of the calls.
+    Returns a list with a response for each request in the same order. A request
+    that raised an exception, such as a timeout, has the exception in its place
+    instead.
+    """
+    client = async_ipc_client.client
+    calls = [(method, url, dict(kwargs)) for method, url, kwargs in calls]
+    caches = [kwargs.pop("cache", "private") for _, _, kwargs in calls]
+    keys = [
+        _async_cache_key(user, cache, method, url, kwargs)
+        for cache, (method, url, kwargs) in zip(caches, calls)
+    ]
+    entries = await asyncio.gather(*[ipc_cache.aget(key) for key in keys])
+
+    # Fresh cached responses don't need the access token
+    results = [
+        _acached_response(entry, url) if entry and entry.is_fresh() else None
+        for entry, (_, url, _) in zip(entries, calls)
+    ]
+    pending = [i for i, result in enumerate(results) if result is None]
+    if not pending:
+        return results
+    if not await sync_to_async(_check_token)(user):
+        responses = [_aforbidden() for _ in pending]
+    else:
+        responses = await asyncio.gather(
+            *[
+                _arequest(client, user, *calls[i], caches[i], keys[i], entries[i])
+                for i in pending
+            ],
+            return_exceptions=True,
+        )
+    for i, response in zip(pending, responses):
+        results[i] = response
+    return results
+
+
+async def _arequest(client, user, method, url, kwargs, cache, key, entry):
+    headers = {**(kwargs.pop("headers", None) or {}), **_conditional_headers(entry)}
+    # Only retry requests whose body can be sent again
+    retry = "files" not in kwargs and isinstance(
+        kwargs.get("content"), (str, bytes, type(None))
     )
+    while True:
+        token = user.credential.access_token
+        response = await client.request(
+            method,
+            url,
+            headers={**headers, "Authorization": f"Bearer {token}"},
+            **kwargs,
+        )
+        if response.status_code != 401 or not retry:
+            break
+        retry = False
+        await response.aclose()
+        # Concurrent requests rejected with the same token share a single refresh
+        if not await sync_to_async(_refresh_credential)(
+            user.credential, lambda credential: credential.access_token == token
+        ):
+            return _aforbidden()
+
+    if key is None:
+        return response
+    public = cache == "public"
+    if response.status_code == 304 and entry is not None:
+        await response.aclose()
+        entry = await ipc_cache.arevalidate(key, entry, response.headers, public)
+        return _acached_response(entry, url)
+    if response.status_code == 200:
+        await ipc_cache.aset(key, response.headers, public, content=response.content)
+    return response
+
+
+def _cache_key(user, cache, url, headers):
+    """
+    Key for caching a GET request, or None if it shouldn't be cached
+    """
+    if not ipc_cache.enabled or cache is None:
+        return None
+    return ipc_cache.key(None if cache == "public" else user.pk, url, headers or {})
+
+
+def _async_cache_key(user, cache, method, url, kwargs):
+    # Only GET requests without a body, cookies or auth are cached
+    if method.upper() != "GET" or not kwargs.keys() <= {
+        "params",
+        "headers",
+        "timeout",
+        "follow_redirects",
+    }:
+        return None
+    full_url = httpx.URL(url).copy_merge_params(kwargs.get("params") or {})
+    return _cache_key(user, cache, str(full_url), kwargs.get("headers"))
+
+
+def _conditional_headers(entry):
+    # Revalidate a stale cached response instead of downloading it again
+    if entry is None or entry.etag is None:
+        return {}
+    return {"If-None-Match": entry.etag}
+
+
+def _cached_response(entry, url):
+    response = requests.models.Response()
+    response.status_code = 200
+    response.reason = "OK"
+    response.headers = CaseInsensitiveDict(entry.headers)
+    response.encoding = get_encoding_from_headers(response.headers)
+    response._content = entry.content
+    response._content_consumed = True
+    response.url = url
+    return response
+
+
+def _acached_response(entry, url):
+    return httpx.Response(
+        200,
+        headers=entry.headers,
+        content=entry.content,
+        request=httpx.Request("GET", url),
+    )
+
+
+def _check_token(user):
+    """
+    Make sure a user has an unexpired access token, refreshing it if needed.
+    Returns false if the access token couldn't be refreshed, or the user has no
+    tokens (such as after purge_accounts).
+    """
+    if _load_credential(user) is None:
+        return False
+    return not _is_expired(user) or _refresh_access_token(user)
+
+
+def _load_credential(user):
+    """
+    Read a user's credential from the READ_DATABASE, unless it's already loaded.
+    Users returned by the backend are routed to the primary, so a lazy
+    `user.credential` would otherwise read the primary. Returns the credential,
+    or None if the user doesn't have one.
+    """
+    related = Credential._meta.get_field("user").remote_field
+    if not related.is_cached(user):
+        credential = (
+            Credential.objects.using(get_read_database(Credential))
+            .filter(user=user)
+            .first()
+        )
+        related.set_cached_value(user, credential)
+    return related.get_cached_value(user)
+
+
+def _forbidden():
+    # Couldn't update the user's access token. Return a response with a 403 status
+    # code as if the user didn't have access to the requested resource
+    response = requests.models.Response()
+    response.status_code = 403
+    return response
+
+
+def _aforbidden():
+    return httpx.Response(403)
+
+
+def _is_expired(user):
+    """
+    Check if a user's access token has expired. Tokens read from the
+    READ_DATABASE are checked against the primary before they're refreshed, since
+    the replica may not have the latest tokens yet.
+    """
+    credential = user.credential
+    if credential.expires_at is not None and credential.expires_at >= timezone.now():
+        return False
+    using = get_write_database(Credential)
+    if credential._state.db != using:
+        credential.refresh_from_db(using=using)
+        return credential.expires_at is None or credential.expires_at < timezone.now()
+    return True
 
 
 def _refresh_access_token(user):
@@ -78,29 +327,84 @@ def _refresh_access_token(user):
     Returns:
         bool: true if the access token is updated, false otherwise.
     """
+    return refresh_credential(user.credential, timezone.now())
+
+
+def refresh_credential(credential, before):
+    """
+    Refresh a credential's tokens unless its access token is valid until at least
+    `before`. Returns true if the credential now has tokens valid until then.
+    """
+    return _refresh_credential(
+        credential,
+        lambda credential: credential.expires_at is None
+        or credential.expires_at < before,
+    )
+
+
+def _refresh_credential(credential, needs_refresh):
+    """
+    Refresh a credential's tokens if needs_refresh returns true for the stored
+    credential. Platform rotates refresh tokens, so concurrent refreshes for the
+    same user are serialized: within a process they share a single refresh, and
+    across processes they wait on a row lock and reuse the token stored by the
+    winner.
+    """
+    refreshed, shared = refresh_flight.do(
+        credential.pk, lambda: _refresh_locked(credential, needs_refresh)
+    )
+    if shared and refreshed:
+        # Another thread refreshed the token, so read it instead
+        credential.refresh_from_db(using=get_write_database(Credential))
+    return refreshed
+
+
+def _refresh_locked(credential, needs_refresh):
+    using = get_write_database(Credential)
+    with transaction.atomic(using=using):
+        # Lock the credential so that refreshes in other processes wait for this
+        # one, then check if one of them already refreshed the token
+        locked = (
+            Credential.objects.using(using).select_for_update().get(pk=credential.pk)
+        )
+        if needs_refresh(locked):
+            if not _request_access_token(locked):
+                return False
+        # Give the caller the stored tokens
+        for field in [
+            "access_token",
+            "access_token_hash",
+            "expires_at",
+            "refresh_token",
+        ]:
+            setattr(credential, field, getattr(locked, field))
+        credential._state.db = using
+        return True
+
+
+def _request_access_token(credential):
+    """
+    Exchange a credential's refresh token for new tokens from Platform and save
+    them in a single-row update
+    """
     body = {
         "grant_type": "refresh_token",
         "client_id": accounts_settings.CLIENT_ID,  # from Product
         "client_secret": accounts_settings.CLIENT_SECRET,  # from Product
-        "refresh_token": user.refreshtoken.token,  # refresh token from user
+        "refresh_token": credential.refresh_token,  # refresh token from user
     }
     try:
-        data = requests.post(
-            url=accounts_settings.PLATFORM_URL + "/accounts/token/", data=body
-        )
+        data = platform_client.post("/accounts/token/", data=body)
         if data.status_code == 200:  # Access token refreshed successfully
             data = data.json()
-            # Update Access token
-            user.accesstoken.token = data["access_token"]
-            user.accesstoken.expires_at = timezone.now() + timedelta(
+            credential.access_token = data["access_token"]
+            credential.expires_at = timezone.now() + timedelta(
                 seconds=data["expires_in"]
             )
-            user.accesstoken.save()
-
-            # Update Refresh Token
-            user.refreshtoken.token = data["refresh_token"]
-            user.refreshtoken.save()
-
+            credential.refresh_token = data["refresh_token"]
+            credential.save(
+                update_fields=["access_token", "expires_at", "refresh_token"]
+            )
             return True
     except requests.exceptions.RequestException:  # Can't connect to platform
         return False
@@ -0,0 +1,182 @@
+import json
+import sys
+from itertools import islice
+
+from django.contrib import auth
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from accounts.backends import LabsUserBackend, get_fingerprint
+from accounts.cache import user_cache
+from accounts.groups import group_cache
+from accounts.models import PlatformProfile
+from accounts.utils import bulk_upsert
+
+
+def get_backend():
+    """
+    Return the configured LabsUserBackend (or subclass) so that users are
+    imported with the same rules as when they log in
+    """
+    for backend in auth.get_backends():
+        if isinstance(backend, LabsUserBackend):
+            return backend
+    return LabsUserBackend()
+
+
+class Command(BaseCommand):
+    help = """
+    Create and update users, groups and group memberships in bulk from a Platform
+    user export, where each line is a JSON user as returned by introspection.
+    Users are synced with the same rules as LabsUserBackend, but the
+    configure_user and post_authenticate hooks are not run.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="path to the export, or - to read stdin")
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="number of users to import in each transaction",
+        )
+
+    def handle(self, *args, **kwargs):
+        if kwargs["batch_size"] < 1:
+            raise CommandError("--batch-size must be positive")
+        self.backend = get_backend()
+        self.verbosity = kwargs["verbosity"]
+        self.counts = {"created": 0, "updated": 0, "unchanged": 0, "skipped": 0}
+
+        if kwargs["path"] == "-":
+            self.import_users(sys.stdin, kwargs["batch_size"])
+        else:
+            try:
+                with open(kwargs["path"]) as f:
+                    self.import_users(f, kwargs["batch_size"])
+            except OSError as e:
+                raise CommandError(f"Could not read {kwargs['path']}: {e}")
+
+        self.stdout.write(
+            "Created {created}, updated {updated}, unchanged {unchanged} "
+            "and skipped {skipped} users".format(**self.counts)
+        )
+
+    def read(self, lines):
+        """
+        Stream users from JSON lines, skipping blank lines
+        """
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                raise CommandError(f"Invalid JSON on line {number}: {e}")
+
+    def import_users(self, lines, batch_size):
+        users = self.read(lines)
+        while batch := list(islice(users, batch_size)):
+            with transaction.atomic():
+                self.import_batch(batch)
+            if self.verbosity > 1:
+                self.stdout.write(f"Imported {sum(self.counts.values())} users")
+
+    def import_batch(self, batch):
+        User = get_user_model()
+        # Later lines for the same user win
+        remote_users = {remote_user["pennid"]: remote_user for remote_user in batch}
+        existing = User.objects.select_related("platformprofile").in_bulk(
+            list(remote_users)
+        )
+
+        new, changed, fields, profiles = [], [], set(), {}
+        for pennid, remote_user in remote_users.items():
+            user = existing.get(pennid)
+            fingerprint = get_fingerprint(remote_user)
+            if user is None:
+                user = User(id=pennid)
+                user.set_unusable_password()
+                self.backend.update_user(user, remote_user)
+                new.append(user)
+            elif self.backend.needs_sync(user, False, fingerprint):
+                fields.update(self.backend.update_user(user, remote_user))
+                changed.append(user)
+            else:
+                self.counts["unchanged"] += 1
+                continue
+            profiles[pennid] = PlatformProfile(
+                **self.backend.get_profile(user, remote_user, fingerprint)
+            )
+
+        # Users that conflict with another user (such as on username) are skipped
+        User.objects.bulk_create(new, ignore_conflicts=True)
+        created = set(
+            User.objects.filter(id__in=[user.id for user in new]).values_list(
+                "id", flat=True
+            )
+        )
+        skipped = [user.id for user in new if user.id not in created]
+        for pennid in skipped:
+            del profiles[pennid]
+        if fields:
+            User.objects.bulk_update(changed, fields)
+        # Bulk queries don't send signals, so remove changed users from the cache
+        user_cache.delete(*[user.id for user in changed])
+        self.counts["created"] += len(created)
+        self.counts["updated"] += len(changed)
+        self.counts["skipped"] += len(skipped)
+
+        self.sync_groups({pennid: remote_users[pennid] for pennid in profiles})
+        self.save_profiles(list(profiles.values()))
+
+    def sync_groups(self, remote_users):
+        """
+        Add missing and remove stale platform group memberships for every user
+        """
+        if not remote_users:
+            return
+        # The through table's columns are named after the user model, which may
+        # be a custom one
+        groups_field = get_user_model()._meta.get_field("groups")
+        Membership = groups_field.remote_field.through
+        user_field = groups_field.m2m_field_name()
+        group_field = groups_field.m2m_reverse_field_name()
+        user_id = Membership._meta.get_field(user_field).attname
+        group_id = Membership._meta.get_field(group_field).attname
+        wanted_names = {
+            pennid: {group_cache.prefix + name for name in remote_user["groups"]}
+            for pennid, remote_user in remote_users.items()
+        }
+        groups = group_cache.get_pks(set().union(*wanted_names.values()))
+        wanted = {
+            (pennid, groups[name])
+            for pennid, names in wanted_names.items()
+            for name in names
+        }
+
+        current = {
+            (user, group): pk
+            for pk, user, group in Membership.objects.filter(
+                **{
+                    f"{user_id}__in": list(remote_users),
+                    f"{group_field}__name__startswith": group_cache.prefix,
+                }
+            ).values_list("pk", user_id, group_id)
+        }
+        stale = [pk for membership, pk in current.items() if membership not in wanted]
+        if stale:
+            Membership.objects.filter(pk__in=stale).delete()
+        Membership.objects.bulk_create(
+            [
+                Membership(**{user_id: user, group_id: group})
+                for user, group in wanted - current.keys()
+            ],
+            ignore_conflicts=True,
+        )
+
+    def save_profiles(self, profiles):
+        bulk_upsert(
+            PlatformProfile, "user", profiles, ["fingerprint", "groups", "permissions"]
+        )
@@ -0,0 +1,115 @@
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from accounts.models import Credential
+from accounts.utils import get_write_database
+
+
+class Command(BaseCommand):
+    help = """
+    Delete credentials whose access token expired more than --grace-days ago and,
+    optionally, users who haven't logged in for --dormant-days. Rows are deleted
+    in small batches by primary key with a pause between batches, so the command
+    can run against a busy database without holding long locks.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--grace-days",
+            type=int,
+            default=30,
+            help="days after expiring to keep a credential, so its refresh token "
+            "can still be used",
+        )
+        parser.add_argument(
+            "--dormant-days",
+            type=int,
+            help="also delete users who last logged in more than this many days ago "
+            "and haven't authenticated since, by session, token or bearer token "
+            "(PlatformProfile.last_seen), and have no newer credential. Staff, "
+            "superusers and users who have never logged in are kept. last_seen is "
+            "only recorded once migration 0008 is applied, so wait at least this "
+            "many days after migrating before using this option.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="number of rows to delete in each transaction",
+        )
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=0.1,
+            help="seconds to wait between batches",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="count the rows that would be deleted without deleting them",
+        )
+
+    def handle(self, *args, **kwargs):
+        if kwargs["batch_size"] < 1:
+            raise CommandError("--batch-size must be positive")
+        self.batch_size = kwargs["batch_size"]
+        self.sleep = kwargs["sleep"]
+        self.dry_run = kwargs["dry_run"]
+        self.verbosity = kwargs["verbosity"]
+        now = timezone.now()
+
+        credentials = self.purge(
+            Credential.objects.filter(
+                expires_at__lt=now - timedelta(days=kwargs["grace_days"])
+            )
+        )
+        users = 0
+        if kwargs["dormant_days"] is not None:
+            cutoff = now - timedelta(days=kwargs["dormant_days"])
+            users = self.purge(
+                get_user_model()
+                .objects.filter(
+                    last_login__lt=cutoff, is_staff=False, is_superuser=False
+                )
+                .exclude(credential__expires_at__gte=cutoff)
+                .exclude(platformprofile__last_seen__gte=cutoff)
+            )
+
+        verb = "Would delete" if self.dry_run else "Deleted"
+        self.stdout.write(
+            f"{verb} {credentials} expired credentials and {users} dormant users"
+        )
+
+    def purge(self, queryset):
+        """
+        Delete the rows matching a queryset in batches, paginating by primary key
+        so that each batch is a bounded index range scan. Returns the number of
+        rows deleted.
+        """
+        using = get_write_database(queryset.model)
+        queryset = queryset.using(using).order_by("pk")
+        name = queryset.model._meta.verbose_name_plural
+        total, last = 0, None
+        while True:
+            batch = queryset if last is None else queryset.filter(pk__gt=last)
+            pks = list(batch.values_list("pk", flat=True)[: self.batch_size])
+            if not pks:
+                return total
+            last = pks[-1]
+            if self.dry_run:
+                total += len(pks)
+            else:
+                with transaction.atomic(using=using):
+                    # Re-check the filter in case a row changed since it was read
+                    _, deleted = queryset.filter(pk__in=pks).delete()
+                total += deleted.get(queryset.model._meta.label, 0)
+            if self.verbosity > 1:
+                self.stdout.write(f"Purged {total} {name}")
+            if len(pks) < self.batch_size:
+                return total
+            time.sleep(self.sleep)
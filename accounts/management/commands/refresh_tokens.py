@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.refresher import refresh_expiring_tokens
+from accounts.settings import accounts_settings
+
+
+class Command(BaseCommand):
+    help = """
+    Refresh the stored access tokens that are about to expire, so that
+    authenticated_request doesn't refresh them during a request. Run this more
+    often than the --window, such as every minute with the default window.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--window",
+            type=int,
+            default=accounts_settings.TOKEN_REFRESH_WINDOW,
+            help="refresh tokens that expire within this many seconds",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=accounts_settings.TOKEN_REFRESH_WORKERS,
+            help="maximum number of concurrent refreshes",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="number of credentials to read at a time",
+        )
+
+    def handle(self, *args, **kwargs):
+        if kwargs["workers"] < 1 or kwargs["batch_size"] < 1:
+            raise CommandError("--workers and --batch-size must be positive")
+        refreshed, failed = refresh_expiring_tokens(
+            kwargs["window"], kwargs["workers"], kwargs["batch_size"]
+        )
+        self.stdout.write(
+            f"Refreshed {refreshed} and failed to refresh {failed} tokens"
+        )
@@ -0,0 +1,54 @@
+# Generated by Django 5.0.14 on 2026-10-17 23:01
+
+from django.db import migrations, models
+
+
+def forwards_func(apps, schema_editor):
+    """
+    Fill in the Platform groups of existing profiles from their users' platform_
+    groups, and clear their fingerprints so that permissions are filled in the
+    next time each user authenticates
+    """
+    PlatformProfile = apps.get_model("accounts", "PlatformProfile")
+    User = PlatformProfile._meta.get_field("user").related_model
+    Membership = User.groups.through
+    user_field = next(
+        field.attname
+        for field in Membership._meta.fields
+        if field.is_relation and field.related_model is User
+    )
+
+    groups = {}
+    for user_id, name in Membership.objects.filter(
+        group__name__startswith="platform_"
+    ).values_list(user_field, "group__name"):
+        groups.setdefault(user_id, []).append(name.removeprefix("platform_"))
+
+    profiles = list(PlatformProfile.objects.only("pk", "user_id"))
+    for profile in profiles:
+        profile.groups = sorted(groups.get(profile.user_id, []))
+        profile.fingerprint = ""
+    PlatformProfile.objects.bulk_update(
+        profiles, ["groups", "fingerprint"], batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0003_platformprofile"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="platformprofile",
+            name="groups",
+            field=models.JSONField(default=list),
+        ),
+        migrations.AddField(
+            model_name="platformprofile",
+            name="permissions",
+            field=models.JSONField(default=list),
+        ),
+        migrations.RunPython(forwards_func, migrations.RunPython.noop),
+    ]
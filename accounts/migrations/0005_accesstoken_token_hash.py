@@ -0,0 +1,32 @@
+# Generated by Django 5.0.14 on 2026-10-17 23:10
+
+from django.db import migrations, models
+
+from accounts.utils import hash_token
+
+
+def forwards_func(apps, schema_editor):
+    """
+    Hash the existing access tokens so that they can be looked up by hash
+    """
+    AccessToken = apps.get_model("accounts", "AccessToken")
+    tokens = list(AccessToken.objects.exclude(token=None).only("pk", "token"))
+    for token in tokens:
+        token.token_hash = hash_token(token.token) if token.token else None
+    AccessToken.objects.bulk_update(tokens, ["token_hash"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0004_platformprofile_groups"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="accesstoken",
+            name="token_hash",
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+        migrations.RunPython(forwards_func, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,162 @@
+# Generated by Django 5.0.14 on 2026-10-17 23:12
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def forwards_func(apps, schema_editor):
+    """
+    Copy each user's access and refresh tokens into a single Credential row
+    """
+    AccessToken = apps.get_model("accounts", "AccessToken")
+    RefreshToken = apps.get_model("accounts", "RefreshToken")
+    Credential = apps.get_model("accounts", "Credential")
+
+    credentials = {}
+    for user_id, token, token_hash, expires_at in AccessToken.objects.values_list(
+        "user_id", "token", "token_hash", "expires_at"
+    ).iterator():
+        credentials[user_id] = Credential(
+            user_id=user_id,
+            access_token=token,
+            access_token_hash=token_hash,
+            expires_at=expires_at,
+        )
+    for user_id, token in RefreshToken.objects.values_list(
+        "user_id", "token"
+    ).iterator():
+        credentials.setdefault(user_id, Credential(user_id=user_id)).refresh_token = (
+            token
+        )
+    Credential.objects.bulk_create(credentials.values(), batch_size=1000)
+
+
+def reverse_func(apps, schema_editor):
+    """
+    Split each Credential back into separate access and refresh tokens
+    """
+    AccessToken = apps.get_model("accounts", "AccessToken")
+    RefreshToken = apps.get_model("accounts", "RefreshToken")
+    Credential = apps.get_model("accounts", "Credential")
+
+    access_tokens, refresh_tokens = [], []
+    for credential in Credential.objects.iterator():
+        if credential.expires_at is not None:
+            access_tokens.append(
+                AccessToken(
+                    user_id=credential.user_id,
+                    token=credential.access_token,
+                    token_hash=credential.access_token_hash,
+                    expires_at=credential.expires_at,
+                )
+            )
+        refresh_tokens.append(
+            RefreshToken(user_id=credential.user_id, token=credential.refresh_token)
+        )
+    AccessToken.objects.bulk_create(access_tokens, batch_size=1000)
+    RefreshToken.objects.bulk_create(refresh_tokens, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0005_accesstoken_token_hash"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Credential",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "access_token",
+                    models.CharField(blank=True, max_length=255, null=True),
+                ),
+                (
+                    "access_token_hash",
+                    models.CharField(
+                        blank=True, db_index=True, max_length=64, null=True
+                    ),
+                ),
+                ("expires_at", models.DateTimeField(blank=True, null=True)),
+                (
+                    "refresh_token",
+                    models.CharField(blank=True, max_length=255, null=True),
+                ),
+            ],
+        ),
+        migrations.RunPython(forwards_func, reverse_func),
+        # Replace the old tables with views of the Credential table
+        migrations.DeleteModel(name="AccessToken"),
+        migrations.DeleteModel(name="RefreshToken"),
+        migrations.CreateModel(
+            name="AccessToken",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "token",
+                    models.CharField(
+                        blank=True, db_column="access_token", max_length=255, null=True
+                    ),
+                ),
+                (
+                    "token_hash",
+                    models.CharField(
+                        blank=True,
+                        db_column="access_token_hash",
+                        max_length=64,
+                        null=True,
+                    ),
+                ),
+                ("expires_at", models.DateTimeField()),
+            ],
+            options={
+                "db_table": "accounts_credential",
+                "abstract": False,
+                "managed": False,
+            },
+        ),
+        migrations.CreateModel(
+            name="RefreshToken",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "token",
+                    models.CharField(
+                        blank=True, db_column="refresh_token", max_length=255, null=True
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "accounts_credential",
+                "abstract": False,
+                "managed": False,
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-17 23:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0006_credential"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="credential",
+            name="expires_at",
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-17 23:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0007_credential_expires_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="platformprofile",
+            name="last_seen",
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -7,19 +7,28 @@ def forwards_func(apps, schema_editor):
     platform_groups = ["alum", "employee", "faculty", "member", "staff", "student"]
 
     # Create platform scoped groups
-    for group in platform_groups:
-        Group.objects.get_or_create(name=f"platform_{group}")
+    names = {f"platform_{name}" for name in platform_groups}
+    Group.objects.bulk_create(
+        [Group(name=name) for name in names], ignore_conflicts=True
+    )
+    # ignore_conflicts doesn't set primary keys, so fetch the groups
+    groups = dict(Group.objects.filter(name__in=names).values_list("name", "pk"))
 
-    # Update groups for every user
-    for user in User.objects.all():
-        for group in user.groups.all():
-            if group.name in platform_groups:
-                user.groups.add(Group.objects.get(name=f"platform_{group.name}"))
-        user.save()
+    # Move every user in an old group to its platform scoped group
+    Membership = User.groups.through
+    old_groups = Group.objects.filter(name__in=platform_groups)
+    Membership.objects.bulk_create(
+        [
+            Membership(user_id=user_id, group_id=groups[f"platform_{name}"])
+            for user_id, name in Membership.objects.filter(
+                group__in=old_groups
+            ).values_list("user_id", "group__name")
+        ],
+        ignore_conflicts=True,
+    )
 
     # Delete old groups
-    for group in platform_groups:
-        Group.objects.filter(name=group).delete()
+    old_groups.delete()
 
 
 class Migration(migrations.Migration):
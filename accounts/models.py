@@ -1,19 +1,105 @@
 from django.conf import settings
 from django.db import models
 
+from accounts.utils import hash_token
 
-class AccessToken(models.Model):
-    token = models.CharField(max_length=255, blank=True, null=True)
-    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
-    expires_at = models.DateTimeField()
+
+class Credential(models.Model):
+    """
+    A user's Platform access and refresh tokens, stored in a single row so that a
+    token refresh is a single-row update
+    """
+
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True
+    )
+    access_token = models.CharField(max_length=255, blank=True, null=True)
+    # Indexed hash of the access token so that PlatformAuthentication can look it up
+    access_token_hash = models.CharField(
+        max_length=64, blank=True, null=True, db_index=True
+    )
+    # Indexed so that expired credentials can be purged (see purge_accounts)
+    expires_at = models.DateTimeField(blank=True, null=True, db_index=True)
+    refresh_token = models.CharField(max_length=255, blank=True, null=True)
+
+    def save(self, *args, **kwargs):
+        self.access_token_hash = (
+            hash_token(self.access_token) if self.access_token else None
+        )
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "access_token" in update_fields:
+            kwargs["update_fields"] = {*update_fields, "access_token_hash"}
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return str(self.user_id)
+
+
+class CredentialView(models.Model):
+    """
+    Backwards compatible view of part of a user's Credential
+    """
+
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True
+    )
+
+    class Meta:
+        abstract = True
+        managed = False
+        db_table = "accounts_credential"
+
+    def save(self, *args, force_insert=False, **kwargs):
+        # Both tokens share a row, so update the row if the other token created it
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return str(self.token)
 
 
-class RefreshToken(models.Model):
-    token = models.CharField(max_length=255, blank=True, null=True)
+class AccessToken(CredentialView):
+    token = models.CharField(
+        max_length=255, blank=True, null=True, db_column="access_token"
+    )
+    token_hash = models.CharField(
+        max_length=64, blank=True, null=True, db_column="access_token_hash"
+    )
+    expires_at = models.DateTimeField()
+
+    class Meta(CredentialView.Meta):
+        pass
+
+    def save(self, *args, **kwargs):
+        self.token_hash = hash_token(self.token) if self.token else None
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "token" in update_fields:
+            kwargs["update_fields"] = {*update_fields, "token_hash"}
+        super().save(*args, **kwargs)
+
+
+class RefreshToken(CredentialView):
+    token = models.CharField(
+        max_length=255, blank=True, null=True, db_column="refresh_token"
+    )
+
+    class Meta(CredentialView.Meta):
+        pass
+
+
+class PlatformProfile(models.Model):
+    """
+    The Platform profile that was last synced to a user. The fingerprint is used
+    to skip writing the user when nothing has changed, and the Platform groups and
+    permissions can be checked without a query (see accounts.utils). last_seen
+    tracks activity from every authentication path, unlike User.last_login.
+    """
+
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    fingerprint = models.CharField(max_length=64)
+    groups = models.JSONField(default=list)
+    permissions = models.JSONField(default=list)
+    # When the user last authenticated, updated at most once a day
+    last_seen = models.DateTimeField(blank=True, null=True, db_index=True)
 
     def __str__(self):
-        return str(self.token)
+        return str(self.fingerprint)
@@ -0,0 +1,262 @@
+import asyncio
+import threading
+import weakref
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlsplit
+
+import requests
+from django.core.exceptions import ImproperlyConfigured
+from requests.adapters import HTTPAdapter
+from requests_oauthlib import OAuth2Session
+from urllib3.util.retry import Retry
+
+from accounts.settings import accounts_settings
+
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+def pooled_session(adapter):
+    """
+    Create a requests session that sends every request through the provided
+    adapter. Cookies are never stored since the session is shared between users.
+    """
+    session = requests.Session()
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class PlatformClient:
+    """
+    Thread-safe HTTP client for Platform. Connections are kept alive in a pool
+    that is shared by every Platform request made by the accounts app.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._adapter = None
+        self._session = None
+
+    @property
+    def adapter(self):
+        if self._adapter is None:
+            with self._lock:
+                if self._adapter is None:
+                    self._adapter = HTTPAdapter(
+                        pool_connections=1,
+                        pool_maxsize=accounts_settings.PLATFORM_POOL_SIZE,
+                    )
+        return self._adapter
+
+    @property
+    def session(self):
+        if self._session is None:
+            adapter = self.adapter
+            with self._lock:
+                if self._session is None:
+                    self._session = pooled_session(adapter)
+        return self._session
+
+    @property
+    def timeout(self):
+        return (
+            accounts_settings.PLATFORM_CONNECT_TIMEOUT,
+            accounts_settings.PLATFORM_READ_TIMEOUT,
+        )
+
+    def request(self, method, path, **kwargs):
+        """
+        Make a request to a path on Platform
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.request(
+            method, accounts_settings.PLATFORM_URL + path, **kwargs
+        )
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def introspect(self, token):
+        """
+        Retrieve information about an access token and its user from Platform
+        """
+        return self.post(
+            "/accounts/introspect/",
+            headers={"Authorization": f"Bearer {token}"},
+            data={"token": token},
+        )
+
+    def oauth_session(self, **kwargs):
+        """
+        Create an OAuth2Session for the product that shares this client's
+        connection pool
+        """
+        session = OAuth2Session(accounts_settings.CLIENT_ID, **kwargs)
+        session.mount("https://", self.adapter)
+        session.mount("http://", self.adapter)
+        return session
+
+    def close(self):
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+            self._adapter = None
+            self._session = None
+
+
+class HostSessionPool:
+    """
+    Thread-safe pooled sessions for IPC requests to other products, one per
+    target host, so that connections are reused between requests. Idempotent
+    requests that fail to connect or get a 502, 503 or 504 response are retried
+    with exponential backoff.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions = {}
+
+    @property
+    def timeout(self):
+        return (
+            accounts_settings.IPC_CONNECT_TIMEOUT,
+            accounts_settings.IPC_READ_TIMEOUT,
+        )
+
+    def get(self, url):
+        """
+        Return the session for the host of a URL
+        """
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        session = self._sessions.get(key)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(key)
+                if session is None:
+                    session = self._sessions[key] = pooled_session(self.adapter())
+        return session
+
+    def adapter(self):
+        retries = Retry(
+            total=accounts_settings.IPC_RETRIES,
+            backoff_factor=accounts_settings.IPC_RETRY_BACKOFF,
+            status_forcelist=[502, 503, 504],
+            allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+            raise_on_status=False,
+        )
+        return HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=accounts_settings.IPC_POOL_SIZE,
+            max_retries=retries,
+        )
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions = {}
+
+
+class AsyncPlatformClient:
+    """
+    Non-blocking HTTP client for Platform built on httpx. Each event loop gets
+    its own connection pool, since httpx clients can't be shared between loops.
+    """
+
+    def __init__(self):
+        self._clients = weakref.WeakKeyDictionary()
+
+    @property
+    def client(self):
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            if httpx is None:
+                raise ImproperlyConfigured(
+                    "httpx is required for async Platform requests. "
+                    "Install django-labs-accounts[async]"
+                )
+            pool_size = accounts_settings.PLATFORM_POOL_SIZE
+            client = httpx.AsyncClient(
+                base_url=accounts_settings.PLATFORM_URL,
+                limits=httpx.Limits(
+                    max_connections=pool_size, max_keepalive_connections=pool_size
+                ),
+                timeout=httpx.Timeout(
+                    accounts_settings.PLATFORM_READ_TIMEOUT,
+                    connect=accounts_settings.PLATFORM_CONNECT_TIMEOUT,
+                ),
+            )
+            # Cookies are never stored since the client is shared between users
+            client.cookies.jar.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+            self._clients[loop] = client
+        return client
+
+    async def request(self, method, path, **kwargs):
+        """
+        Make a request to a path on Platform
+        """
+        return await self.client.request(method, path, **kwargs)
+
+    async def post(self, path, **kwargs):
+        return await self.request("POST", path, **kwargs)
+
+    async def introspect(self, token):
+        """
+        Retrieve information about an access token and its user from Platform
+        """
+        return await self.post(
+            "/accounts/introspect/",
+            headers={"Authorization": f"Bearer {token}"},
+            data={"token": token},
+        )
+
+
+class AsyncIPCClient:
+    """
+    Non-blocking HTTP client for IPC requests to other products built on httpx.
+    Each event loop gets its own client, which keeps a connection pool per host.
+    Requests that fail to connect are retried, but unlike HostSessionPool,
+    error responses aren't.
+    """
+
+    def __init__(self):
+        self._clients = weakref.WeakKeyDictionary()
+
+    @property
+    def client(self):
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            if httpx is None:
+                raise ImproperlyConfigured(
+                    "httpx is required for async IPC requests. "
+                    "Install django-labs-accounts[async]"
+                )
+            pool_size = accounts_settings.IPC_POOL_SIZE
+            client = httpx.AsyncClient(
+                transport=httpx.AsyncHTTPTransport(
+                    limits=httpx.Limits(max_keepalive_connections=pool_size),
+                    retries=accounts_settings.IPC_RETRIES,
+                ),
+                timeout=httpx.Timeout(
+                    accounts_settings.IPC_READ_TIMEOUT,
+                    connect=accounts_settings.IPC_CONNECT_TIMEOUT,
+                ),
+            )
+            # Cookies are never stored since the client is shared between users
+            client.cookies.jar.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+            self._clients[loop] = client
+        return client
+
+
+platform_client = PlatformClient()
+ipc_sessions = HostSessionPool()
+async_ipc_client = AsyncIPCClient()
+async_platform_client = AsyncPlatformClient()
@@ -0,0 +1,99 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import connections
+from django.utils import timezone
+
+from accounts.ipc import refresh_credential
+from accounts.models import Credential
+from accounts.settings import accounts_settings
+from accounts.utils import get_write_database
+
+
+logger = logging.getLogger(__name__)
+
+
+def refresh_expiring_tokens(window=None, workers=None, batch_size=100):
+    """
+    Refresh the access tokens that expire within the next `window` seconds, so
+    that authenticated_request doesn't have to refresh them during a request.
+    Credentials are read in batches by primary key, and each batch is refreshed
+    with at most `workers` concurrent requests to Platform.
+    Returns a tuple of the number of credentials refreshed and the number that
+    couldn't be refreshed.
+    """
+    if window is None:
+        window = accounts_settings.TOKEN_REFRESH_WINDOW
+    if workers is None:
+        workers = accounts_settings.TOKEN_REFRESH_WORKERS
+    now = timezone.now()
+    before = now + timedelta(seconds=window)
+    credentials = (
+        Credential.objects.using(get_write_database(Credential))
+        .filter(expires_at__gte=now, expires_at__lt=before)
+        .exclude(refresh_token=None)
+        .order_by("pk")
+    )
+
+    def refresh(credential):
+        try:
+            return refresh_credential(credential, before)
+        finally:
+            connections.close_all()
+
+    refreshed = failed = 0
+    last = None
+    with ThreadPoolExecutor(workers) as executor:
+        while True:
+            batch = credentials if last is None else credentials.filter(pk__gt=last)
+            batch = list(batch[:batch_size])
+            if not batch:
+                break
+            last = batch[-1].pk
+            for result in executor.map(refresh, batch):
+                if result:
+                    refreshed += 1
+                else:
+                    failed += 1
+            if len(batch) < batch_size:
+                break
+    return refreshed, failed
+
+
+class TokenRefresher:
+    """
+    Background thread that refreshes expiring access tokens every
+    TOKEN_REFRESH_INTERVAL seconds. Started by AccountsConfig.ready when
+    TOKEN_REFRESHER is enabled.
+    """
+
+    def __init__(self):
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="accounts-token-refresher", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(accounts_settings.TOKEN_REFRESH_INTERVAL):
+            try:
+                refresh_expiring_tokens()
+            except Exception:
+                logger.exception("Could not refresh expiring access tokens")
+            finally:
+                connections.close_all()
+
+
+token_refresher = TokenRefresher()
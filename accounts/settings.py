@@ -13,6 +13,35 @@ DEFAULTS = {
     "PLATFORM_URL": "https://platform.pennlabs.org",
     "ADMIN_PERMISSION": "example_admin",
     "CUSTOM_ADMIN": True,
+    "INTROSPECTION_CACHE": None,
+    "INTROSPECTION_CACHE_TTL": 300,
+    "INTROSPECTION_SINGLE_FLIGHT": True,
+    "INTROSPECTION_CACHE_LOCK": False,
+    "INTROSPECTION_NEGATIVE_CACHE_TTL": 30,
+    "FAILED_AUTHENTICATION_RATE": None,
+    "VERIFY_JWT_LOCALLY": False,
+    "LOCAL_TOKEN_LOOKUP": False,
+    "READ_DATABASE": None,
+    "USER_CACHE": None,
+    "USER_CACHE_TTL": 300,
+    "WRITE_BEHIND": False,
+    "WRITE_BEHIND_QUEUE_SIZE": 1000,
+    "WRITE_BEHIND_BATCH_SIZE": 100,
+    "TOKEN_REFRESHER": False,
+    "TOKEN_REFRESH_WINDOW": 300,
+    "TOKEN_REFRESH_INTERVAL": 60,
+    "TOKEN_REFRESH_WORKERS": 4,
+    "PLATFORM_POOL_SIZE": 10,
+    "PLATFORM_CONNECT_TIMEOUT": 5,
+    "PLATFORM_READ_TIMEOUT": 10,
+    "IPC_POOL_SIZE": 10,
+    "IPC_CONNECT_TIMEOUT": 5,
+    "IPC_READ_TIMEOUT": 30,
+    "IPC_RETRIES": 2,
+    "IPC_RETRY_BACKOFF": 0.5,
+    "IPC_CACHE": None,
+    "IPC_CACHE_TTL": 300,
+    "IPC_CACHE_MAX_SIZE": 1024 * 1024,
 }
 
 
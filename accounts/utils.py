@@ -0,0 +1,110 @@
+import hashlib
+
+from django.db import connections, router
+
+from accounts.settings import accounts_settings
+
+
+def hash_token(token):
+    """
+    Return a hex digest of a token that is safe to use as a cache key or to store
+    in the database in place of the raw token
+    """
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def get_read_database(model):
+    """
+    Return the database to read a model from for authentication: the
+    READ_DATABASE if set, otherwise the database chosen by the database routers
+    """
+    return accounts_settings.READ_DATABASE or router.db_for_read(model)
+
+
+def get_write_database(model):
+    return router.db_for_write(model)
+
+
+def for_write(instance):
+    """
+    Route later saves of an instance read from the READ_DATABASE to the primary.
+    Django's default routing writes an instance to the database it was read
+    from, so without this a product saving request.user would write to the
+    replica. Returns the instance, which may be None.
+    """
+    if instance is not None:
+        instance._state.db = get_write_database(type(instance))
+    return instance
+
+
+def get_upsert_kwargs(model, unique_field, values):
+    """
+    Return the bulk_create arguments that turn an insert into an upsert on the
+    database used for a model, or None if the database doesn't support upserts
+    """
+    features = connections[router.db_for_write(model)].features
+    update_fields = [field for field in values if field != unique_field]
+    if features.supports_update_conflicts_with_target:
+        return {
+            "update_conflicts": True,
+            "unique_fields": [unique_field],
+            "update_fields": update_fields,
+        }
+    if features.supports_update_conflicts:
+        return {"update_conflicts": True, "update_fields": update_fields}
+    return None
+
+
+def upsert(model, unique_field, **values):
+    """
+    Insert a row, or update the row with the same value for unique_field, in a
+    single INSERT ... ON CONFLICT query. Falls back to update_or_create on
+    databases that don't support upserts.
+    """
+    if kwargs := get_upsert_kwargs(model, unique_field, values):
+        model.objects.bulk_create([model(**values)], **kwargs)
+    else:
+        lookup = {unique_field: values.pop(unique_field)}
+        model.objects.update_or_create(defaults=values, **lookup)
+
+
+def bulk_upsert(model, unique_field, objs, fields):
+    """
+    Insert objects, or update the given fields of the rows with the same value for
+    unique_field, in a single query. Falls back to update_or_create on databases
+    that don't support upserts.
+    """
+    if kwargs := get_upsert_kwargs(model, unique_field, [unique_field, *fields]):
+        model.objects.bulk_create(objs, **kwargs)
+    else:
+        for obj in objs:
+            model.objects.update_or_create(
+                defaults={field: getattr(obj, field) for field in fields},
+                **{unique_field: getattr(obj, unique_field)},
+            )
+
+
+def get_platform_profile(user):
+    """
+    Return the Platform profile that was last synced to a user, or None.
+    LabsUserBackend loads users with their profile, so this doesn't need a query.
+    """
+    if not user.is_authenticated:
+        return None
+    return getattr(user, "platformprofile", None)
+
+
+def has_platform_group(user, group):
+    """
+    Check if a user is in a Platform group (ex. "student") without a query
+    """
+    profile = get_platform_profile(user)
+    return profile is not None and group in profile.groups
+
+
+def has_platform_permission(user, permission):
+    """
+    Check if a user has a Platform permission (ex. "example_admin") without a query
+    """
+    profile = get_platform_profile(user)
+    return profile is not None and permission in profile.permissions
@@ -1,6 +1,5 @@
 import datetime
 
-import requests
 from django.contrib import auth
 from django.contrib.auth import get_user_model
 from django.http import HttpResponseServerError, JsonResponse
@@ -12,7 +11,8 @@ from django.views import View
 from django.views.decorators.csrf import csrf_exempt
 from requests_oauthlib import OAuth2Session
 
-from accounts.models import AccessToken, RefreshToken
+from accounts.models import Credential
+from accounts.platform import platform_client
 from accounts.settings import accounts_settings
 
 
@@ -75,10 +75,8 @@ class CallbackView(View):
             invalid_next(return_to)
             return_to = "/"
         state = request.session.pop("state")
-        platform = OAuth2Session(
-            accounts_settings.CLIENT_ID,
-            redirect_uri=get_redirect_uri(request),
-            state=state,
+        platform = platform_client.oauth_session(
+            redirect_uri=get_redirect_uri(request), state=state
         )
 
         # Get the user's access and refresh tokens
@@ -86,14 +84,11 @@ class CallbackView(View):
             accounts_settings.PLATFORM_URL + "/accounts/token/",
             client_secret=accounts_settings.CLIENT_SECRET,
             authorization_response=request.build_absolute_uri(),
+            timeout=platform_client.timeout,
         )
 
         # Use the access token to log in the user using information from platform
-        platform = OAuth2Session(accounts_settings.CLIENT_ID, token=token)
-        introspect_url = accounts_settings.PLATFORM_URL + "/accounts/introspect/"
-        platform_request = platform.post(
-            introspect_url, data={"token": token["access_token"]}
-        )
+        platform_request = platform_client.introspect(token["access_token"])
         if platform_request.status_code == 200:  # Connected to platform successfully
             user_props = platform_request.json()["user"]
             user_props["token"] = token
@@ -129,16 +124,11 @@ class TokenView(View):
 
     def post(self, request):
         # Hit Platform OAuth2 token provider
-        token_url = accounts_settings.PLATFORM_URL + "/accounts/token/"
-        response = requests.post(token_url, data=request.POST.dict())
+        response = platform_client.post("/accounts/token/", data=request.POST.dict())
         if response.status_code == 200:
             token = response.json()
             # Use the access token to retrieve user information from platform
-            platform = OAuth2Session(accounts_settings.CLIENT_ID, token=token)
-            introspect_url = accounts_settings.PLATFORM_URL + "/accounts/introspect/"
-            platform_request = platform.post(
-                introspect_url, data={"token": token["access_token"]}
-            )
+            platform_request = platform_client.introspect(token["access_token"])
             if (
                 platform_request.status_code == 200
             ):  # Connected to platform successfully
@@ -148,17 +138,15 @@ class TokenView(View):
                 if not user:
                     return JsonResponse({"detail": "Invalid User"}, status=400)
                 # Update user Access and Refresh tokens
-                AccessToken.objects.update_or_create(
+                Credential.objects.update_or_create(
                     user=user,
                     defaults={
+                        "access_token": token["access_token"],
                         "expires_at": timezone.now()
                         + datetime.timedelta(seconds=token["expires_in"]),
-                        "token": token["access_token"],
+                        "refresh_token": token["refresh_token"],
                     },
                 )
-                RefreshToken.objects.update_or_create(
-                    user=user, defaults={"token": token["refresh_token"]}
-                )
                 return JsonResponse(response.json())
             return JsonResponse({"detail": "Invalid tokens"}, status=403)
         return JsonResponse({"detail": "Invalid parameters"}, status=400)
@@ -0,0 +1,115 @@
+import atexit
+import logging
+import threading
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.db import connections, transaction
+
+from accounts.cache import user_cache
+from accounts.models import PlatformProfile
+from accounts.settings import accounts_settings
+from accounts.utils import bulk_upsert, get_write_database
+
+
+logger = logging.getLogger(__name__)
+
+
+def write_updates(updates):
+    """
+    Write a batch of queued user updates in one transaction. Each update is a
+    tuple of (backend, user fields, Platform group names, profile). Profiles are
+    written last, so a user whose update fails is synced again at their next login.
+    """
+    User = get_user_model()
+    using = get_write_database(User)
+    users = [User(pk=profile["user"].pk, **fields) for _, fields, _, profile in updates]
+    with transaction.atomic(using=using):
+        User.objects.using(using).bulk_update(users, list(updates[0][1]))
+        for user, (backend, _, group_names, _) in zip(users, updates):
+            user._state.db = using
+            backend.sync_groups(user, group_names)
+        bulk_upsert(
+            PlatformProfile,
+            "user",
+            [PlatformProfile(**profile) for *_, profile in updates],
+            ["fingerprint", "groups", "permissions", "last_seen"],
+        )
+        # Bulk updates don't send signals, so remove the users from the cache
+        user_cache.delete(*[user.pk for user in users])
+
+
+class WriteBehindQueue:
+    """
+    Bounded queue of user updates that a background thread writes to the database
+    in batches, so that name, email and group changes from Platform don't hold up
+    the request that noticed them. Queued updates for the same user are coalesced
+    and only the latest is written.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._pending = {}
+        self._writing = False
+        self._thread = None
+
+    @property
+    def enabled(self):
+        return accounts_settings.WRITE_BEHIND
+
+    def put(self, user_id, update):
+        """
+        Queue an update for a user, replacing any queued update for the same user.
+        If the queue is full the update is written right away instead.
+        """
+        with self._condition:
+            full = len(self._pending) >= accounts_settings.WRITE_BEHIND_QUEUE_SIZE
+            if user_id in self._pending or not full:
+                self._pending[user_id] = update
+                self.start()
+                self._condition.notify_all()
+                return
+        write_updates([update])
+
+    def start(self):
+        # Also restarts the worker in processes forked after it was started
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._run, name="accounts-write-behind", daemon=True
+            )
+            self._thread.start()
+
+    def flush(self, timeout=None):
+        """
+        Wait until every queued update has been written. Returns False if the
+        timeout expired first.
+        """
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: not self._pending and not self._writing, timeout
+            )
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending)
+                user_ids = list(
+                    islice(self._pending, accounts_settings.WRITE_BEHIND_BATCH_SIZE)
+                )
+                batch = [self._pending.pop(user_id) for user_id in user_ids]
+                self._writing = True
+            try:
+                write_updates(batch)
+            except Exception:
+                logger.exception("Could not write %d queued user updates", len(batch))
+            finally:
+                connections.close_all()
+                with self._condition:
+                    self._writing = False
+                    self._condition.notify_all()
+
+
+write_behind = WriteBehindQueue()
+
+# Write queued updates before the process exits
+atexit.register(write_behind.flush, 10)
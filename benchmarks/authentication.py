@@ -0,0 +1,254 @@
+"""
+Benchmark the authentication hot path: PlatformAuthentication introspecting an
+access token with a local stand-in Platform, then LabsUserBackend syncing the user.
+
+Usage:
+
+    python -m benchmarks.authentication --concurrency 1 4 16 --output results.json
+
+Each scenario is run at every concurrency level. Per-request latency, SQL
+query counts and throughput are written as JSON so that results can be compared
+between releases. The benchmark flushes the database named by the Django
+settings (a scratch SQLite database by default), so never point it at real data.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from importlib import metadata
+
+from benchmarks.platform import PlatformServer
+
+
+# Number of distinct users in the unchanged and changed groups scenarios.
+# Concurrent requests are spread over these users.
+USERS = 50
+
+
+class Scenario:
+    name = None
+
+    def __init__(self, offset):
+        self.offset = offset
+
+    def setup(self, authenticate):
+        pass
+
+    def token(self, n):
+        raise NotImplementedError
+
+
+class NewUser(Scenario):
+    """
+    Every request authenticates a user that doesn't exist yet
+    """
+
+    name = "new_user"
+
+    def token(self, n):
+        return f"{self.name}:{self.offset + n}:0"
+
+
+class UnchangedUser(Scenario):
+    """
+    Every request authenticates an existing user whose Platform profile hasn't
+    changed since they last authenticated
+    """
+
+    name = "unchanged_user"
+
+    def setup(self, authenticate):
+        # Create every user with their first generation of Platform groups
+        for n in range(USERS):
+            authenticate(f"{self.name}:{self.offset + n}:0")
+
+    def token(self, n):
+        return f"{self.name}:{self.offset + n % USERS}:0"
+
+
+class ChangedGroups(UnchangedUser):
+    """
+    Every request authenticates an existing user whose Platform groups changed
+    since they last authenticated
+    """
+
+    name = "changed_groups"
+
+    def token(self, n):
+        return f"{self.name}:{self.offset + n % USERS}:{n // USERS + 1}"
+
+
+SCENARIOS = [NewUser, UnchangedUser, ChangedGroups]
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    index = min(len(values) - 1, round(percent / 100 * (len(values) - 1)))
+    return values[index]
+
+
+def summarize(values):
+    if not values:
+        return {}
+    return {
+        "mean": sum(values) / len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values),
+    }
+
+
+def run(scenario, concurrency, requests):
+    """
+    Authenticate a number of requests split between concurrent threads
+    """
+    from django.db import connection
+    from django.test import RequestFactory
+    from django.test.utils import CaptureQueriesContext
+
+    from accounts.authentication import PlatformAuthentication
+
+    factory = RequestFactory()
+    counter = itertools.count()
+    lock = threading.Lock()
+    latencies, queries, errors = [], [], []
+
+    def authenticate(token):
+        request = factory.get("/", HTTP_AUTHORIZATION=f"Bearer {token}")
+        user, _ = PlatformAuthentication().authenticate(request)
+        if user is None:
+            raise ValueError("No user was authenticated")
+
+    def worker():
+        try:
+            while (n := next(counter)) < requests:
+                with CaptureQueriesContext(connection) as captured:
+                    start = time.perf_counter()
+                    try:
+                        authenticate(scenario.token(n))
+                        error = None
+                    except Exception as e:
+                        error = repr(e)
+                    latency = time.perf_counter() - start
+                with lock:
+                    latencies.append(latency * 1000)
+                    queries.append(len(captured))
+                    if error is not None:
+                        errors.append(error)
+        finally:
+            connection.close()
+
+    scenario.setup(authenticate)
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    return {
+        "scenario": scenario.name,
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": len(errors),
+        "error_samples": sorted(set(errors))[:5],
+        "elapsed_s": elapsed,
+        "throughput_rps": requests / elapsed,
+        "latency_ms": summarize(latencies),
+        "queries": summarize(queries),
+    }
+
+
+def get_metadata(args):
+    from django import get_version
+    from django.db import connection
+
+    try:
+        version = metadata.version("django-labs-accounts")
+    except metadata.PackageNotFoundError:
+        version = None
+
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "version": version,
+        "python": platform.python_version(),
+        "django": get_version(),
+        "database": connection.vendor,
+        "requests": args.requests,
+        "platform_latency_ms": args.platform_latency,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--concurrency", type=int, nargs="+", default=[1, 4, 16], metavar="N"
+    )
+    parser.add_argument(
+        "--requests", type=int, default=500, help="requests per scenario and level"
+    )
+    parser.add_argument(
+        "--scenario",
+        choices=[scenario.name for scenario in SCENARIOS],
+        nargs="+",
+        default=[scenario.name for scenario in SCENARIOS],
+    )
+    parser.add_argument(
+        "--platform-latency",
+        type=float,
+        default=0,
+        help="milliseconds the stand-in Platform waits before responding",
+    )
+    parser.add_argument("--output", help="file to write results to (default stdout)")
+    args = parser.parse_args(argv)
+
+    server = PlatformServer(latency=args.platform_latency / 1000).start()
+    os.environ["BENCHMARK_PLATFORM_URL"] = server.url
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+
+    import django
+    from django.core.management import call_command
+
+    django.setup()
+    call_command("migrate", verbosity=0)
+    call_command("flush", interactive=False, verbosity=0)
+
+    results = []
+    offset = 1
+    for scenario in SCENARIOS:
+        if scenario.name not in args.scenario:
+            continue
+        for concurrency in args.concurrency:
+            # Give every run its own users
+            result = run(scenario(offset), concurrency, args.requests)
+            offset += args.requests + USERS
+            print(
+                f"{result['scenario']:>16} x{concurrency:<3} "
+                f"{result['throughput_rps']:8.1f} req/s  "
+                f"p50 {result['latency_ms']['p50']:7.2f} ms  "
+                f"p99 {result['latency_ms']['p99']:7.2f} ms  "
+                f"{result['queries']['mean']:5.1f} queries  "
+                f"{result['errors']} errors",
+                file=sys.stderr,
+            )
+            results.append(result)
+    server.stop()
+
+    output = json.dumps({"metadata": get_metadata(args), "results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+GROUPS = [["student", "member"], ["staff", "employee"]]
+
+
+def get_user(token):
+    """
+    Build the Platform profile for a benchmark access token. Tokens look like
+    "<scenario>:<pennid>:<generation>", and the user's groups alternate between
+    generations so that a new generation changes the user's Platform profile.
+    """
+    _, pennid, generation = token.split(":")
+    return {
+        "pennid": int(pennid),
+        "first_name": "Bench",
+        "last_name": f"User {pennid}",
+        "username": f"bench{pennid}",
+        "email": f"bench{pennid}@example.com",
+        "affiliation": [],
+        "user_permissions": [],
+        "groups": GROUPS[int(generation) % len(GROUPS)],
+    }
+
+
+class PlatformHandler(BaseHTTPRequestHandler):
+    """
+    Stand-in for the Platform introspection endpoint. Every other endpoint
+    (such as the identity JWKS and attest endpoints) returns a 404.
+    """
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.respond(404, {})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = parse_qs(self.rfile.read(length).decode("utf-8"))
+        if self.path != "/accounts/introspect/" or "token" not in body:
+            return self.respond(404, {})
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        token = body["token"][0]
+        self.respond(200, {"exp": time.time() + 3600, "user": get_user(token)})
+
+    def respond(self, status, data):
+        content = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class PlatformServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency=0):
+        super().__init__(("127.0.0.1", 0), PlatformHandler)
+        self.latency = latency
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,27 @@
+"""
+Django settings for the benchmarks. Uses the test settings with a scratch
+database and the stand-in Platform started by the benchmark runner.
+"""
+
+import os
+import tempfile
+
+from tests.settings import *  # noqa: F401, F403
+from tests.settings import PLATFORM_ACCOUNTS
+
+
+DATABASES = {
+    "default": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": os.environ.get(
+            "BENCHMARK_DATABASE",
+            os.path.join(tempfile.gettempdir(), "accounts-benchmark.sqlite"),
+        ),
+        "OPTIONS": {"timeout": 30},
+    }
+}
+
+PLATFORM_ACCOUNTS = {
+    **PLATFORM_ACCOUNTS,
+    "PLATFORM_URL": os.environ.get("BENCHMARK_PLATFORM_URL", "http://127.0.0.1"),
+}
@@ -69,6 +69,14 @@ def validate_urn(urn):
         raise ImproperlyConfigured(f"Invalid urn: '{urn}'")
 
 
+def looks_like_jwt(token):
+    """
+    Check if a token has the shape of a compact serialized JWT
+    (three base64url encoded segments separated by periods).
+    """
+    return bool(re.match(r"^[A-Za-z0-9_-]+\.[A-Za-z0-9_-]+\.[A-Za-z0-9_-]*$", token))
+
+
 def get_validated_claims(token):
     """
     Validates JWT and returns the claims if validated, None otherwise.
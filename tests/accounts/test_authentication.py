@@ -1,10 +1,33 @@
-from unittest.mock import patch
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest.mock import AsyncMock, Mock, patch
 
+import httpx
+from asgiref.sync import sync_to_async
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.test import TestCase
+from django.utils import timezone
 from requests.exceptions import RequestException
-from rest_framework import status
-from rest_framework.test import APIClient
+from rest_framework import exceptions, status
+from rest_framework.test import APIClient, APIRequestFactory
+
+from accounts.authentication import (
+    AsyncPlatformAuthentication,
+    PlatformAuthentication,
+    aauthenticate,
+    introspection_flight,
+)
+from accounts.backends import LabsUserBackend
+from accounts.cache import introspection_cache
+from accounts.models import AccessToken
+from accounts.settings import accounts_settings
+from accounts.utils import hash_token
+from identity.identity import container
+from tests.identity.utils import ID_PRIVATE_KEY, configure_container, mint_refresh_jwt
 
 
 User = get_user_model()
@@ -12,7 +35,7 @@ User = get_user_model()
 
 # Tests modified from django-rest-framework
 # https://github.com/encode/django-rest-framework/blob/71e6c30034a1dd35a39ca74f86c371713e762c79/tests/authentication/test_authentication.py#L270  # noqa
-@patch("accounts.authentication.requests.post")
+@patch("accounts.authentication.platform_client.post")
 class PlatformAuthenticationTestCase(TestCase):
     def setUp(self):
         self.csrf_client = APIClient(enforce_csrf_checks=True)
@@ -139,3 +162,391 @@ class PlatformAuthenticationTestCase(TestCase):
             self.path, {"example": "example"}, format="json"
         )
         self.assertEqual(status.HTTP_401_UNAUTHORIZED, response.status_code)
+
+
+@patch("accounts.authentication.platform_client.post")
+class IntrospectionCacheTestCase(TestCase):
+    def setUp(self):
+        self.csrf_client = APIClient(enforce_csrf_checks=True)
+        self.path = "/token/"
+        self.auth = "Bearer abc"
+        self.valid_response = {
+            "exp": time.time() + 100,
+            "user": {
+                "pennid": 123,
+                "first_name": "first",
+                "last_name": "last",
+                "username": "abc",
+                "email": "test@test.com",
+                "affiliation": [],
+                "user_permissions": [],
+                "groups": ["student"],
+            },
+        }
+        cache.clear()
+        introspection_cache.reset_stats()
+
+    def test_cache_hit(self, mock_request):
+        mock_request.return_value.status_code = 200
+        mock_request.return_value.json.return_value = self.valid_response
+        with patch.object(accounts_settings, "INTROSPECTION_CACHE", "default"):
+            for _ in range(3):
+                response = self.csrf_client.post(
+                    self.path, {"example": "example"}, HTTP_AUTHORIZATION=self.auth
+                )
+                self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(1, mock_request.call_count)
+        self.assertEqual({"hits": 2, "misses": 1}, introspection_cache.stats())
+
+    @patch.object(accounts_settings, "INTROSPECTION_NEGATIVE_CACHE_TTL", 0)
+    def test_invalid_token_not_cached(self, mock_request):
+        mock_request.return_value.status_code = 403
+        with patch.object(accounts_settings, "INTROSPECTION_CACHE", "default"):
+            for _ in range(2):
+                response = self.csrf_client.post(
+                    self.path, {"example": "example"}, HTTP_AUTHORIZATION=self.auth
+                )
+                self.assertEqual(status.HTTP_401_UNAUTHORIZED, response.status_code)
+        self.assertEqual(2, mock_request.call_count)
+
+    def test_invalid_token_negative_cache(self, mock_request):
+        mock_request.return_value.status_code = 403
+        with patch.object(accounts_settings, "INTROSPECTION_CACHE", "default"):
+            for _ in range(3):
+                response = self.csrf_client.post(
+                    self.path, {"example": "example"}, HTTP_AUTHORIZATION=self.auth
+                )
+                self.assertEqual(status.HTTP_401_UNAUTHORIZED, response.status_code)
+        self.assertEqual(1, mock_request.call_count)
+
+    def test_platform_error_not_negative_cached(self, mock_request):
+        mock_request.return_value.status_code = 503
+        with patch.object(accounts_settings, "INTROSPECTION_CACHE", "default"):
+            for _ in range(2):
+                self.csrf_client.post(
+                    self.path, {"example": "example"}, HTTP_AUTHORIZATION=self.auth
+                )
+        self.assertEqual(2, mock_request.call_count)
+
+    @patch.object(accounts_settings, "INTROSPECTION_CACHE", "default")
+    @patch.object(accounts_settings, "FAILED_AUTHENTICATION_RATE", "2/min")
+    def test_rate_limited_not_negative_cached(self, mock_request):
+        mock_request.return_value.status_code = 429
+        for _ in range(3):
+            response = self.csrf_client.post(
+                self.path, {"example": "example"}, HTTP_AUTHORIZATION=self.auth
+            )
+            # Not throttled, since Platform never rejected the token
+            self.assertEqual(status.HTTP_401_UNAUTHORIZED, response.status_code)
+            self.assertIn("Could not verify", response.json()["detail"])
+        self.assertEqual(3, mock_request.call_count)
+
+        # Valid once Platform recovers
+        mock_request.return_value.status_code = 200
+        mock_request.return_value.json.return_value = self.valid_response
+        response = self.csrf_client.post(
+            self.path, {"example": "example"}, HTTP_AUTHORIZATION=self.auth
+        )
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+
+    def test_platform_error_valid_jwt(self, mock_request):
+        configure_container(self)
+        mock_request.return_value.status_code = 503
+        request = APIRequestFactory().get(
+            "/", HTTP_AUTHORIZATION=f"Bearer {container.access_jwt.serialize()}"
+        )
+        self.assertEqual((None, None), PlatformAuthentication().authenticate(request))
+        mock_request.assert_called_once()
+
+    @patch.object(accounts_settings, "INTROSPECTION_CACHE", "default")
+    @patch.object(accounts_settings, "FAILED_AUTHENTICATION_RATE", "2/min")
+    def test_failed_authentication_rate(self, mock_request):
+        mock_request.return_value.status_code = 403
+        statuses = [
+            self.csrf_client.post(
+                self.path, {"example": "example"}, HTTP_AUTHORIZATION=f"Bearer {i}"
+            ).status_code
+            for i in range(3)
+        ]
+        self.assertEqual(
+            [
+                status.HTTP_401_UNAUTHORIZED,
+                status.HTTP_401_UNAUTHORIZED,
+                status.HTTP_429_TOO_MANY_REQUESTS,
+            ],
+            statuses,
+        )
+        self.assertEqual(2, mock_request.call_count)
+
+    def test_cache_disabled(self, mock_request):
+        mock_request.return_value.status_code = 200
+        mock_request.return_value.json.return_value = self.valid_response
+        for _ in range(2):
+            self.csrf_client.post(
+                self.path, {"example": "example"}, HTTP_AUTHORIZATION=self.auth
+            )
+        self.assertEqual(2, mock_request.call_count)
+        self.assertEqual({"hits": 0, "misses": 0}, introspection_cache.stats())
+
+
+@patch("accounts.authentication.platform_client.post")
+@patch.object(accounts_settings, "VERIFY_JWT_LOCALLY", True)
+class VerifyJWTLocallyTestCase(TestCase):
+    def setUp(self):
+        configure_container(self)
+        self.factory = APIRequestFactory()
+        self.authentication = PlatformAuthentication()
+
+    def authenticate(self, token):
+        request = self.factory.get("/", HTTP_AUTHORIZATION=f"Bearer {token}")
+        return self.authentication.authenticate(request)
+
+    def test_valid_jwt(self, mock_request):
+        token = container.access_jwt.serialize()
+        self.assertEqual((None, None), self.authenticate(token))
+        mock_request.assert_not_called()
+
+    def test_invalid_jwt(self, mock_request):
+        token = mint_refresh_jwt(ID_PRIVATE_KEY, self.urn).serialize()
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authenticate(token)
+        mock_request.assert_not_called()
+
+    def test_opaque_token(self, mock_request):
+        mock_request.return_value.status_code = 403
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authenticate("abc")
+        mock_request.assert_called_once()
+
+    def test_missing_jwks(self, mock_request):
+        container.platform_jwks = None
+        mock_request.return_value.status_code = 200
+        mock_request.return_value.json.return_value = {"user": None}
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authenticate(container.access_jwt.serialize())
+        mock_request.assert_called_once()
+
+
+@patch("accounts.authentication.platform_client.post")
+@patch.object(accounts_settings, "LOCAL_TOKEN_LOOKUP", True)
+class LocalTokenLookupTestCase(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.authentication = PlatformAuthentication()
+        self.user = User.objects.create(id=123, username="abc")
+        self.accesstoken = AccessToken.objects.create(
+            user=self.user, token="abc", expires_at=timezone.now() + timedelta(1)
+        )
+
+    def authenticate(self, token="abc"):
+        request = self.factory.get("/", HTTP_AUTHORIZATION=f"Bearer {token}")
+        return self.authentication.authenticate(request)
+
+    def test_known_token(self, mock_request):
+        with self.assertNumQueries(1):
+            user, _ = self.authenticate()
+        self.assertEqual(self.user, user)
+        mock_request.assert_not_called()
+
+    def test_unknown_token(self, mock_request):
+        mock_request.return_value.status_code = 403
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authenticate("other")
+        mock_request.assert_called_once()
+
+    def test_expired_token(self, mock_request):
+        self.accesstoken.expires_at = timezone.now()
+        self.accesstoken.save()
+        mock_request.return_value.status_code = 403
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authenticate()
+        mock_request.assert_called_once()
+
+    def test_inactive_user(self, mock_request):
+        self.user.is_active = False
+        self.user.save()
+        mock_request.return_value.status_code = 403
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authenticate()
+        mock_request.assert_called_once()
+
+    @patch("accounts.authentication.async_platform_client.post", new_callable=AsyncMock)
+    async def test_async_known_token(self, mock_async_request, mock_request):
+        request = self.factory.get("/", HTTP_AUTHORIZATION="Bearer abc")
+        user, _ = await AsyncPlatformAuthentication().authenticate(request)
+        self.assertEqual(self.user, user)
+        mock_async_request.assert_not_called()
+
+
+@patch("accounts.authentication.auth.authenticate")
+@patch("accounts.authentication.platform_client.post")
+class SingleFlightTestCase(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.authentication = PlatformAuthentication()
+        self.user = User(id=123, username="abc")
+        self.release = threading.Event()
+        cache.clear()
+
+    def authenticate(self):
+        request = self.factory.get("/", HTTP_AUTHORIZATION="Bearer abc")
+        return self.authentication.authenticate(request)
+
+    def waiting(self):
+        call = introspection_flight._calls.get(hash_token("abc"))
+        return len(call.done._cond._waiters) if call else 0
+
+    def introspect(self, *args, **kwargs):
+        self.release.wait(5)
+        response = Mock(status_code=200)
+        response.json.return_value = {"user": {"pennid": 123}}
+        return response
+
+    def test_concurrent_requests_coalesced(self, mock_request, mock_authenticate):
+        mock_request.side_effect = self.introspect
+        mock_authenticate.return_value = self.user
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            futures = [executor.submit(self.authenticate) for _ in range(5)]
+            # Wait until the other requests are waiting on the first introspection
+            while self.waiting() < 4:
+                time.sleep(0.01)
+            self.release.set()
+            users = [future.result()[0] for future in futures]
+        self.assertEqual(1, mock_request.call_count)
+        self.assertEqual(1, mock_authenticate.call_count)
+        self.assertTrue(all(user == self.user for user in users))
+        self.assertEqual(5, len({id(user) for user in users}))
+
+    def test_single_flight_disabled(self, mock_request, mock_authenticate):
+        self.release.set()
+        mock_request.side_effect = self.introspect
+        mock_authenticate.return_value = self.user
+        with patch.object(accounts_settings, "INTROSPECTION_SINGLE_FLIGHT", False):
+            self.assertEqual((self.user, None), self.authenticate())
+        mock_request.assert_called_once()
+
+    @patch.object(accounts_settings, "INTROSPECTION_CACHE", "default")
+    @patch.object(accounts_settings, "INTROSPECTION_CACHE_LOCK", True)
+    def test_cache_lock(self, mock_request, mock_authenticate):
+        # Another process is introspecting the token and caches the response
+        introspection_cache.cache.add(
+            introspection_cache.lock_prefix + hash_token("abc"), True
+        )
+        introspection_cache.set("abc", {"user": {"pennid": 123}})
+        with patch.object(introspection_cache, "get", return_value=None):
+            self.authentication.authenticate_token("abc")
+        mock_request.assert_not_called()
+        mock_authenticate.assert_called_with(remote_user={"pennid": 123}, tokens=False)
+
+
+@patch("accounts.authentication.async_platform_client.post", new_callable=AsyncMock)
+class AsyncPlatformAuthenticationTestCase(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.authentication = AsyncPlatformAuthentication()
+        self.valid_response = {
+            "exp": time.time() + 100,
+            "user": {
+                "pennid": 123,
+                "first_name": "first",
+                "last_name": "last",
+                "username": "abc",
+                "email": "test@test.com",
+                "affiliation": [],
+                "user_permissions": [],
+                "groups": ["student", "member"],
+            },
+        }
+        cache.clear()
+
+    async def authenticate(self, authorization="Bearer abc"):
+        request = self.factory.get("/", HTTP_AUTHORIZATION=authorization)
+        return await self.authentication.authenticate(request)
+
+    async def test_valid_token(self, mock_request):
+        mock_request.return_value = Mock(status_code=200)
+        mock_request.return_value.json.return_value = self.valid_response
+        user, _ = await self.authenticate()
+        self.assertEqual(123, user.id)
+        self.assertEqual("abc", user.username)
+        self.assertTrue(await User.objects.filter(id=123).aexists())
+
+    async def test_invalid_token(self, mock_request):
+        mock_request.return_value = Mock(status_code=403)
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            await self.authenticate()
+
+    @patch.object(accounts_settings, "INTROSPECTION_CACHE", "default")
+    async def test_rate_limited_not_negative_cached(self, mock_request):
+        mock_request.return_value = Mock(status_code=429)
+        for _ in range(2):
+            with self.assertRaises(exceptions.AuthenticationFailed):
+                await self.authenticate()
+        self.assertEqual(2, mock_request.call_count)
+
+    async def test_platform_error_valid_jwt(self, mock_request):
+        configure_container(self)
+        mock_request.return_value = Mock(status_code=503)
+        token = container.access_jwt.serialize()
+        self.assertEqual((None, None), await self.authenticate(f"Bearer {token}"))
+        mock_request.assert_called_once()
+
+    async def test_connection_problem(self, mock_request):
+        mock_request.side_effect = httpx.ConnectError("error")
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            await self.authenticate()
+
+    async def test_other_keyword(self, mock_request):
+        self.assertIsNone(await self.authenticate("Basic abc"))
+        mock_request.assert_not_called()
+
+    async def test_inactive_user(self, mock_request):
+        await User.objects.acreate(id=123, username="abc", is_active=False)
+        mock_request.return_value = Mock(status_code=200)
+        mock_request.return_value.json.return_value = self.valid_response
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            await self.authenticate()
+
+    @patch.object(accounts_settings, "INTROSPECTION_CACHE", "default")
+    async def test_cache_hit(self, mock_request):
+        mock_request.return_value = Mock(status_code=200)
+        mock_request.return_value.json.return_value = self.valid_response
+        await self.authenticate()
+        await self.authenticate()
+        mock_request.assert_called_once()
+
+    async def test_concurrent_requests_coalesced(self, mock_request):
+        async def introspect(*args, **kwargs):
+            await asyncio.sleep(0.05)
+            response = Mock(status_code=200)
+            response.json.return_value = self.valid_response
+            return response
+
+        mock_request.side_effect = introspect
+        results = await asyncio.gather(*[self.authenticate() for _ in range(5)])
+        mock_request.assert_called_once()
+        self.assertEqual(5, len({id(user) for user, _ in results}))
+
+    async def test_valid_token_uses_async_backend(self, mock_request):
+        mock_request.return_value = Mock(status_code=200)
+        mock_request.return_value.json.return_value = self.valid_response
+        with patch.object(LabsUserBackend, "authenticate") as mock_authenticate:
+            user, _ = await self.authenticate()
+        mock_authenticate.assert_not_called()
+        self.assertEqual("accounts.backends.LabsUserBackend", user.backend)
+
+
+class AAuthenticateTestCase(TestCase):
+    async def test_invalid_credentials(self):
+        self.assertIsNone(await aauthenticate(remote_user=None))
+
+    async def test_sync_backend(self):
+        with self.settings(
+            AUTHENTICATION_BACKENDS=["django.contrib.auth.backends.ModelBackend"]
+        ):
+            await sync_to_async(User.objects.create_user)(
+                username="user", password="password"
+            )
+            user = await aauthenticate(username="user", password="password")
+        self.assertEqual("user", user.username)
+        self.assertEqual("django.contrib.auth.backends.ModelBackend", user.backend)
@@ -1,10 +1,20 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest.mock import patch
+
 from django.contrib import auth
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
-from django.test import TestCase
+from django.db import IntegrityError, connection, connections, router
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 
-from accounts.backends import LabsUserBackend
-from accounts.models import AccessToken, RefreshToken
+from accounts.backends import LabsUserBackend, get_fingerprint
+from accounts.groups import group_cache
+from accounts.models import AccessToken, PlatformProfile, RefreshToken
+from accounts.settings import accounts_settings
+from accounts.utils import hash_token
 
 
 class BackendTestCase(TestCase):
@@ -54,10 +64,17 @@ class BackendTestCase(TestCase):
         self.assertEqual(
             self.remote_user["token"]["access_token"], user.accesstoken.token
         )
+        self.assertEqual(hash_token("abc"), user.accesstoken.token_hash)
         self.assertEqual(
             self.remote_user["token"]["refresh_token"], user.refreshtoken.token
         )
 
+    def test_create_user_username_conflict(self):
+        self.remote_user["username"] = self.test_user.username
+        with self.assertRaises(IntegrityError):
+            auth.authenticate(remote_user=self.remote_user)
+        self.assertFalse(self.User.objects.filter(id=1).exists())
+
     def test_update_user(self):
         self.assertEqual(len(self.User.objects.all()), 1)
         auth.authenticate(remote_user=self.remote_user)
@@ -163,6 +180,69 @@ class BackendTestCase(TestCase):
         self.assertNotIn(self.student_group, user.groups.all())
         self.assertNotIn(self.staff_group, user.groups.all())
 
+    def test_sync_groups_query_count(self):
+        def sync_groups(group_names):
+            with CaptureQueriesContext(connection) as queries:
+                LabsUserBackend().sync_groups(self.test_user, group_names)
+            return len(queries)
+
+        # Replace the user's platform groups with new ones, few and many
+        few = sync_groups(["a", "b"])
+        many = sync_groups([f"group{i}" for i in range(50)])
+        self.assertEqual(few, many)
+        self.assertEqual(
+            50, self.test_user.groups.filter(name__startswith="platform_").count()
+        )
+        self.assertIn(self.custom_group, self.test_user.groups.all())
+
+        # Existing groups and memberships don't need any writes
+        with self.assertNumQueries(2):
+            LabsUserBackend().sync_groups(
+                self.test_user, [f"group{i}" for i in range(50)]
+            )
+
+    def test_unchanged_profile_skips_writes(self):
+        auth.authenticate(remote_user=self.remote_user, tokens=False)
+        # Only the user (with its profile) is read
+        with self.assertNumQueries(1):
+            user = auth.authenticate(remote_user=self.remote_user, tokens=False)
+        self.assertEqual(2, user.groups.all().count())
+
+    def test_last_seen(self):
+        user = auth.authenticate(remote_user=self.remote_user, tokens=False)
+        last_seen = user.platformprofile.last_seen
+        self.assertIsNotNone(last_seen)
+
+        # Unchanged users not seen for a day only update last_seen
+        PlatformProfile.objects.filter(user=user).update(
+            last_seen=last_seen - timedelta(days=2)
+        )
+        with CaptureQueriesContext(connection) as queries:
+            auth.authenticate(remote_user=self.remote_user, tokens=False)
+        writes = [q["sql"] for q in queries if not q["sql"].startswith("SELECT")]
+        self.assertEqual(1, len([sql for sql in writes if sql.startswith("UPDATE")]))
+        self.assertGreaterEqual(
+            PlatformProfile.objects.get(user=user).last_seen, last_seen
+        )
+
+    def test_changed_profile_saves_changed_fields(self):
+        auth.authenticate(remote_user=self.remote_user, tokens=False)
+        self.remote_user["email"] = "changed@test.com"
+        with patch.object(self.User, "save", autospec=True) as mock_save:
+            auth.authenticate(remote_user=self.remote_user, tokens=False)
+        mock_save.assert_called_once()
+        self.assertEqual(["email"], mock_save.call_args[1]["update_fields"])
+        profile = PlatformProfile.objects.get(user_id=self.remote_user["pennid"])
+        self.assertEqual(get_fingerprint(self.remote_user), profile.fingerprint)
+
+    def test_fingerprint(self):
+        fingerprint = get_fingerprint(self.remote_user)
+        self.remote_user["groups"] = list(reversed(self.remote_user["groups"]))
+        self.remote_user["token"] = {}
+        self.assertEqual(fingerprint, get_fingerprint(self.remote_user))
+        self.remote_user["user_permissions"] = ["example_admin"]
+        self.assertNotEqual(fingerprint, get_fingerprint(self.remote_user))
+
     def test_custom_backend(self):
         with self.settings(
             AUTHENTICATION_BACKENDS=("tests.accounts.test_backends.CustomBackend",)
@@ -171,7 +251,202 @@ class BackendTestCase(TestCase):
             self.assertEqual(user.first_name, "Modified")
 
 
+class AsyncBackendTestCase(TestCase):
+    def setUp(self):
+        self.User = get_user_model()
+        self.backend = LabsUserBackend()
+        self.remote_user = {
+            "pennid": 1,
+            "first_name": "First",
+            "last_name": "Last",
+            "username": "user",
+            "email": "test@test.com",
+            "affiliation": [],
+            "user_permissions": [],
+            "groups": ["student", "member"],
+            "token": {"access_token": "abc", "refresh_token": "123", "expires_in": 100},
+        }
+
+    async def test_invalid_remote_user(self):
+        self.assertIsNone(await self.backend.aauthenticate(None, remote_user=None))
+
+    async def test_create_user(self):
+        user = await self.backend.aauthenticate(None, remote_user=self.remote_user)
+        user = await self.User.objects.select_related(
+            "accesstoken", "refreshtoken"
+        ).aget(id=user.id)
+        self.assertEqual("user", user.username)
+        self.assertEqual("test@test.com", user.email)
+        self.assertFalse(user.has_usable_password())
+        self.assertEqual("abc", user.accesstoken.token)
+        self.assertEqual("123", user.refreshtoken.token)
+        groups = [group.name async for group in user.groups.order_by("name")]
+        self.assertEqual(["platform_member", "platform_student"], groups)
+
+    async def test_update_user(self):
+        await self.backend.aauthenticate(None, remote_user=self.remote_user)
+        self.remote_user["email"] = "changed@test.com"
+        self.remote_user["user_permissions"] = ["example_admin"]
+        self.remote_user["groups"] = ["staff"]
+        await self.backend.aauthenticate(None, remote_user=self.remote_user)
+        user = await self.User.objects.aget(id=1)
+        self.assertEqual("changed@test.com", user.email)
+        self.assertTrue(user.is_staff)
+        self.assertTrue(user.is_superuser)
+        groups = [group.name async for group in user.groups.all()]
+        self.assertEqual(["platform_staff"], groups)
+
+    async def test_unchanged_profile_skips_writes(self):
+        await self.backend.aauthenticate(None, remote_user=self.remote_user)
+        with patch.object(self.backend, "write_user") as mock_sync:
+            await self.backend.aauthenticate(
+                None, remote_user=self.remote_user, tokens=False
+            )
+        mock_sync.assert_not_called()
+
+    async def test_sync_is_atomic(self):
+        await self.backend.aauthenticate(None, remote_user=self.remote_user)
+        fingerprint = get_fingerprint(self.remote_user)
+        self.remote_user["email"] = "changed@test.com"
+        with patch.object(self.backend, "sync_user", side_effect=ValueError):
+            with self.assertRaises(ValueError):
+                await self.backend.aauthenticate(None, remote_user=self.remote_user)
+        # The profile written before the failure was rolled back
+        profile = await PlatformProfile.objects.aget(user_id=1)
+        self.assertEqual(fingerprint, profile.fingerprint)
+
+    async def test_post_authenticate(self):
+        backend = CustomBackend()
+        user = await backend.aauthenticate(None, remote_user=self.remote_user)
+        self.assertEqual("Modified", user.first_name)
+
+
 class CustomBackend(LabsUserBackend):
     def post_authenticate(self, user, created, dictionary):
         user.first_name = "Modified"
         user.save()
+
+
+class ConcurrentProvisioningTestCase(TransactionTestCase):
+    def setUp(self):
+        # Groups are removed between transactional tests
+        group_cache.clear()
+        self.User = get_user_model()
+
+    def remote_user(self, pennid):
+        return {
+            "pennid": pennid,
+            "first_name": "First",
+            "last_name": "Last",
+            "username": f"user{pennid}",
+            "email": "test@test.com",
+            "affiliation": [],
+            "user_permissions": [],
+            "groups": ["student", "member"],
+            "token": {"access_token": "abc", "refresh_token": "123", "expires_in": 100},
+        }
+
+    def test_login_storm(self):
+        threads = 16
+        barrier = threading.Barrier(threads)
+        configured = []
+
+        def configure_user(request, user):
+            configured.append(user.id)
+            return user
+
+        def login(n):
+            barrier.wait()
+            try:
+                return auth.authenticate(remote_user=self.remote_user(n % 4 + 1))
+            finally:
+                connection.close()
+
+        with patch.object(
+            LabsUserBackend, "configure_user", side_effect=configure_user
+        ), ThreadPoolExecutor(threads) as executor:
+            users = list(executor.map(login, range(threads)))
+
+        self.assertTrue(all(users))
+        self.assertEqual(4, len(configured))
+        self.assertEqual(4, self.User.objects.count())
+        self.assertEqual(4, AccessToken.objects.count())
+        self.assertEqual(4, RefreshToken.objects.count())
+        self.assertEqual(4, PlatformProfile.objects.count())
+        self.assertEqual(8, self.User.groups.through.objects.count())
+
+
+@patch.object(accounts_settings, "READ_DATABASE", "replica")
+class ReadDatabaseTestCase(TransactionTestCase):
+    databases = {"default", "replica"}
+
+    def setUp(self):
+        # Groups are removed between transactional tests
+        group_cache.clear()
+        self.remote_user = {
+            "pennid": 1,
+            "first_name": "First",
+            "last_name": "Last",
+            "username": "user",
+            "email": "test@test.com",
+            "affiliation": [],
+            "user_permissions": [],
+            "groups": ["student", "member"],
+        }
+        auth.authenticate(remote_user=self.remote_user, tokens=False)
+
+    def authenticate(self):
+        with CaptureQueriesContext(
+            connections["default"]
+        ) as primary, CaptureQueriesContext(connections["replica"]) as replica:
+            user = auth.authenticate(remote_user=self.remote_user, tokens=False)
+        return user, primary, replica
+
+    def test_unchanged_user_reads_replica(self):
+        user, primary, replica = self.authenticate()
+        self.assertEqual(0, len(primary))
+        self.assertEqual(1, len(replica))
+        self.assertEqual(
+            "default", router.db_for_write(get_user_model(), instance=user)
+        )
+
+    def test_unchanged_user_saves_to_primary(self):
+        user, _, _ = self.authenticate()
+        user.first_name = "Changed"
+        with CaptureQueriesContext(connections["replica"]) as replica:
+            user.save(update_fields=["first_name"])
+        self.assertEqual(0, len(replica))
+        self.assertEqual("Changed", get_user_model().objects.get().first_name)
+
+    def test_changed_user_writes_primary(self):
+        self.remote_user["email"] = "changed@test.com"
+        user, primary, replica = self.authenticate()
+        self.assertEqual(1, len(replica))
+        self.assertTrue(
+            any(query["sql"].startswith("UPDATE") for query in primary.captured_queries)
+        )
+        self.assertEqual("default", user._state.db)
+        self.assertEqual("changed@test.com", get_user_model().objects.get().email)
+
+    def test_get_user_reads_replica(self):
+        with CaptureQueriesContext(connections["default"]) as primary:
+            user = LabsUserBackend().get_user(1)
+        self.assertEqual(0, len(primary))
+        self.assertEqual(
+            "default", router.db_for_write(get_user_model(), instance=user)
+        )
+        with CaptureQueriesContext(connections["replica"]) as replica:
+            user.groups.add(Group.objects.create(name="other"))
+        self.assertEqual(0, len(replica))
+
+    def test_get_user_falls_back_to_primary(self):
+        user = LaggingReplicaBackend().get_user(1)
+        self.assertEqual(1, user.id)
+        self.assertIsNone(LaggingReplicaBackend().get_user(2))
+
+
+class LaggingReplicaBackend(LabsUserBackend):
+    def get_users(self, using=None):
+        users = super().get_users(using)
+        # Simulate a replica that hasn't caught up with the primary
+        return users.none() if users.db == "replica" else users
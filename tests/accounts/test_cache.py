@@ -0,0 +1,279 @@
+import os
+import time
+from unittest.mock import patch
+
+from django.contrib import auth
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.test import TestCase
+
+from accounts.backends import LabsUserBackend
+from accounts.cache import (
+    failed_authentications,
+    introspection_cache,
+    ipc_cache,
+    user_cache,
+)
+from accounts.settings import accounts_settings
+from accounts.utils import has_platform_permission, hash_token
+
+
+@patch.object(accounts_settings, "INTROSPECTION_CACHE", "default")
+class IntrospectionCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        introspection_cache.reset_stats()
+
+    def test_key_does_not_contain_token(self):
+        key = introspection_cache.key("abc")
+        self.assertNotIn("abc", key.replace(introspection_cache.prefix, ""))
+        self.assertTrue(key.endswith(hash_token("abc")))
+
+    def test_ttl_bounded_by_expiry(self):
+        with patch.object(introspection_cache.cache, "set") as mock_set:
+            introspection_cache.set("abc", {"exp": time.time() + 10})
+        self.assertLessEqual(mock_set.call_args[0][2], 10)
+
+    def test_ttl_bounded_by_setting(self):
+        with patch.object(introspection_cache.cache, "set") as mock_set:
+            introspection_cache.set("abc", {"exp": time.time() + 10000})
+        self.assertEqual(
+            accounts_settings.INTROSPECTION_CACHE_TTL, mock_set.call_args[0][2]
+        )
+
+    def test_expired_token_not_cached(self):
+        introspection_cache.set("abc", {"exp": time.time() - 10})
+        self.assertIsNone(introspection_cache.get("abc"))
+
+    def test_stats(self):
+        introspection_cache.set("abc", {"exp": time.time() + 100})
+        introspection_cache.get("abc")
+        introspection_cache.get("def")
+        self.assertEqual({"hits": 1, "misses": 1}, introspection_cache.stats())
+
+
+@patch.object(accounts_settings, "INTROSPECTION_CACHE", "default")
+class NegativeCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_reject(self):
+        self.assertFalse(introspection_cache.is_rejected("abc"))
+        introspection_cache.reject("abc")
+        self.assertTrue(introspection_cache.is_rejected("abc"))
+        self.assertFalse(introspection_cache.is_rejected("def"))
+
+    @patch.object(accounts_settings, "INTROSPECTION_NEGATIVE_CACHE_TTL", 0)
+    def test_disabled(self):
+        introspection_cache.reject("abc")
+        self.assertFalse(introspection_cache.is_rejected("abc"))
+
+    async def test_async_reject(self):
+        await introspection_cache.areject("abc")
+        self.assertTrue(await introspection_cache.ais_rejected("abc"))
+
+
+@patch.object(accounts_settings, "INTROSPECTION_CACHE", "default")
+@patch.object(accounts_settings, "FAILED_AUTHENTICATION_RATE", "2/hour")
+class FailedAuthenticationLimiterTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_rate(self):
+        self.assertEqual((2, 3600), failed_authentications.rate())
+
+    def test_limit(self):
+        for _ in range(2):
+            self.assertFalse(failed_authentications.is_limited("127.0.0.1"))
+            failed_authentications.record("127.0.0.1")
+        self.assertTrue(failed_authentications.is_limited("127.0.0.1"))
+        self.assertFalse(failed_authentications.is_limited("127.0.0.2"))
+
+    def test_disabled(self):
+        with patch.object(accounts_settings, "FAILED_AUTHENTICATION_RATE", None):
+            for _ in range(5):
+                failed_authentications.record("127.0.0.1")
+            self.assertFalse(failed_authentications.is_limited("127.0.0.1"))
+
+    async def test_async_limit(self):
+        for _ in range(2):
+            await failed_authentications.arecord("127.0.0.1")
+        self.assertTrue(await failed_authentications.ais_limited("127.0.0.1"))
+
+
+@patch.object(accounts_settings, "USER_CACHE", "default")
+class UserCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.backend = LabsUserBackend()
+        self.group = Group.objects.create(name="platform_test")
+        self.user = get_user_model().objects.create(id=1, username="user")
+        self.user.groups.add(self.group)
+
+    def test_get_user(self):
+        with self.assertNumQueries(2):
+            self.backend.get_user(1)
+        with self.assertNumQueries(0):
+            user = self.backend.get_user(1)
+            groups = [group.name for group in user.groups.all()]
+        self.assertEqual("user", user.username)
+        self.assertEqual(["platform_test"], groups)
+
+    def test_missing_user(self):
+        self.assertIsNone(self.backend.get_user(2))
+        self.assertIsNone(user_cache.get(2))
+
+    def test_inactive_user(self):
+        self.user.is_active = False
+        self.user.save()
+        self.assertIsNone(self.backend.get_user(1))
+
+    def test_disabled(self):
+        with patch.object(accounts_settings, "USER_CACHE", None):
+            self.backend.get_user(1)
+            with self.assertNumQueries(1):
+                self.backend.get_user(1)
+
+    def test_invalidate_on_profile_change(self):
+        remote_user = {
+            "pennid": 1,
+            "first_name": "",
+            "last_name": "",
+            "username": "user",
+            "email": "",
+            "user_permissions": [],
+            "groups": [],
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            auth.authenticate(remote_user=remote_user, tokens=False)
+        self.backend.get_user(1)
+        # Only the user's Platform permissions change
+        remote_user["user_permissions"] = ["x"]
+        with self.captureOnCommitCallbacks(execute=True):
+            auth.authenticate(remote_user=remote_user, tokens=False)
+        self.assertTrue(has_platform_permission(self.backend.get_user(1), "x"))
+
+    def test_invalidate_on_save(self):
+        self.backend.get_user(1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.first_name = "Changed"
+            self.user.save()
+        self.assertEqual("Changed", self.backend.get_user(1).first_name)
+
+    def test_invalidate_on_delete(self):
+        self.backend.get_user(1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        self.assertIsNone(self.backend.get_user(1))
+
+    def test_invalidate_on_group_change(self):
+        self.backend.get_user(1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.groups.remove(self.group)
+        self.assertEqual(0, len(self.backend.get_user(1).groups.all()))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.group.user_set.add(self.user)
+        self.assertEqual(1, len(self.backend.get_user(1).groups.all()))
+
+    def test_invalidate_on_group_clear(self):
+        self.backend.get_user(1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.group.user_set.clear()
+        self.assertEqual(0, len(self.backend.get_user(1).groups.all()))
+
+    def test_invalidate_on_group_delete(self):
+        self.backend.get_user(1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.group.delete()
+        self.assertEqual(0, len(self.backend.get_user(1).groups.all()))
+
+    def test_invalidate_on_authenticate(self):
+        self.backend.get_user(1)
+        remote_user = {
+            "pennid": 1,
+            "first_name": "First",
+            "last_name": "Last",
+            "username": "user",
+            "email": "test@test.com",
+            "affiliation": [],
+            "user_permissions": [],
+            "groups": ["student"],
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            auth.authenticate(remote_user=remote_user, tokens=False)
+        user = self.backend.get_user(1)
+        self.assertEqual("First", user.first_name)
+        self.assertEqual(["platform_student"], [g.name for g in user.groups.all()])
+        # Authenticating with an unchanged profile keeps the cached user
+        with self.captureOnCommitCallbacks(execute=True):
+            auth.authenticate(remote_user=remote_user, tokens=False)
+        with self.assertNumQueries(0):
+            self.backend.get_user(1)
+
+
+@patch.object(accounts_settings, "IPC_CACHE", "default")
+class IPCResponseCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def lifetime(self, cache_control, public=False):
+        return ipc_cache.lifetime({"cache-control": cache_control}, public)
+
+    def test_lifetime(self):
+        self.assertEqual(60, self.lifetime("max-age=60"))
+        self.assertEqual(60, self.lifetime('public, max-age="60"'))
+        self.assertEqual(300, self.lifetime("max-age=86400"))
+        self.assertEqual(0, self.lifetime("no-cache, max-age=60"))
+        self.assertEqual(0, self.lifetime("max-age=abc"))
+        self.assertEqual(0, self.lifetime(""))
+        self.assertIsNone(self.lifetime("no-store"))
+
+    def test_shared_lifetime(self):
+        self.assertEqual(60, self.lifetime("private, max-age=60"))
+        self.assertIsNone(self.lifetime("private, max-age=60", public=True))
+        self.assertEqual(10, self.lifetime("max-age=60, s-maxage=10", public=True))
+
+    def test_key_per_owner(self):
+        key = ipc_cache.key(1, "https://example.com/", {"Accept": "text/html"})
+        self.assertEqual(
+            key, ipc_cache.key(1, "https://example.com/", {"accept": "text/html"})
+        )
+        self.assertNotEqual(key, ipc_cache.key(2, "https://example.com/", {}))
+        self.assertNotEqual(key, ipc_cache.key(None, "https://example.com/", {}))
+
+    def test_compressed_body(self):
+        content = b"a" * 10000
+        headers = {"Cache-Control": "max-age=60", "Content-Length": "10000"}
+        entry = ipc_cache.set("key", headers, False, content=content)
+        self.assertEqual(entry, cache.get("key"))
+        self.assertLess(len(entry.body), 100)
+        self.assertEqual(content, entry.content)
+        self.assertEqual({"cache-control": "max-age=60"}, entry.headers)
+        self.assertTrue(entry.is_fresh())
+
+    def test_max_size(self):
+        content = os.urandom(1000)
+        with patch.object(accounts_settings, "IPC_CACHE_MAX_SIZE", 100):
+            ipc_cache.set("key", {"ETag": '"a"'}, False, content=content)
+        self.assertIsNone(cache.get("key"))
+
+    def test_uncacheable_response_removes_entry(self):
+        ipc_cache.set("key", {"ETag": '"a"'}, False, content=b"old")
+        ipc_cache.set("key", {"Cache-Control": "no-store"}, False, content=b"new")
+        self.assertIsNone(cache.get("key"))
+
+    def test_stale_entry_with_etag(self):
+        with patch.object(ipc_cache.cache, "set") as mock_set:
+            entry = ipc_cache.set("key", {"ETag": '"a"'}, False, content=b"abc")
+        self.assertFalse(entry.is_fresh())
+        self.assertEqual('"a"', entry.etag)
+        self.assertEqual(300, mock_set.call_args[0][2])
+
+    def test_revalidate(self):
+        entry = ipc_cache.set("key", {"ETag": '"a"'}, False, content=b"abc")
+        headers = {"Cache-Control": "max-age=60", "ETag": '"a"'}
+        entry = ipc_cache.revalidate("key", entry, headers, False)
+        self.assertTrue(entry.is_fresh())
+        self.assertEqual(b"abc", entry.content)
+        self.assertEqual(entry, cache.get("key"))
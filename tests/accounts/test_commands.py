@@ -0,0 +1,170 @@
+import json
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib import auth
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from accounts.backends import get_fingerprint
+from accounts.models import Credential, PlatformProfile
+
+
+class ImportPlatformUsersTestCase(TestCase):
+    def setUp(self):
+        self.User = get_user_model()
+        self.remote_users = [
+            {
+                "pennid": pennid,
+                "first_name": "First",
+                "last_name": "Last",
+                "username": f"user{pennid}",
+                "email": f"user{pennid}@test.com",
+                "affiliation": [],
+                "user_permissions": [],
+                "groups": ["student", "member"],
+            }
+            for pennid in range(1, 6)
+        ]
+
+    def import_users(self, remote_users, *args):
+        with tempfile.NamedTemporaryFile("w", suffix=".jsonl") as f:
+            for remote_user in remote_users:
+                f.write(json.dumps(remote_user) + "\n")
+            f.flush()
+            out = StringIO()
+            call_command("import_platform_users", f.name, *args, stdout=out)
+        return out.getvalue()
+
+    def test_create_users(self):
+        self.remote_users[0]["user_permissions"] = ["example_admin"]
+        out = self.import_users(self.remote_users, "--batch-size", "2")
+        self.assertIn("Created 5, updated 0, unchanged 0 and skipped 0 users", out)
+        self.assertEqual(5, self.User.objects.count())
+        user = self.User.objects.get(id=1)
+        self.assertEqual("user1", user.username)
+        self.assertEqual("user1@test.com", user.email)
+        self.assertFalse(user.has_usable_password())
+        self.assertTrue(user.is_staff)
+        self.assertTrue(user.is_superuser)
+        self.assertFalse(self.User.objects.get(id=2).is_staff)
+        self.assertEqual(
+            ["platform_member", "platform_student"],
+            list(user.groups.order_by("name").values_list("name", flat=True)),
+        )
+        profile = PlatformProfile.objects.get(user=user)
+        self.assertEqual(get_fingerprint(self.remote_users[0]), profile.fingerprint)
+        self.assertEqual(["member", "student"], profile.groups)
+        self.assertEqual(["example_admin"], profile.permissions)
+
+    def test_update_users(self):
+        custom = Group.objects.create(name="custom")
+        self.import_users(self.remote_users)
+        self.User.objects.get(id=2).groups.add(custom)
+        self.remote_users[1]["email"] = "changed@test.com"
+        self.remote_users[1]["groups"] = ["alum"]
+        out = self.import_users(self.remote_users)
+        self.assertIn("Created 0, updated 1, unchanged 4 and skipped 0 users", out)
+        user = self.User.objects.get(id=2)
+        self.assertEqual("changed@test.com", user.email)
+        self.assertEqual(
+            ["custom", "platform_alum"],
+            list(user.groups.order_by("name").values_list("name", flat=True)),
+        )
+
+    def test_login_after_import(self):
+        self.import_users(self.remote_users)
+        remote_user = {
+            **self.remote_users[0],
+            "token": {"access_token": "abc", "refresh_token": "123", "expires_in": 100},
+        }
+        # The imported profile is up to date, so the first login only records
+        # when the user was seen, and later logins only read the user
+        with patch.object(self.User, "save") as mock_save:
+            auth.authenticate(remote_user=remote_user, tokens=False)
+        mock_save.assert_not_called()
+        self.assertIsNotNone(PlatformProfile.objects.get(user_id=1).last_seen)
+        with self.assertNumQueries(1):
+            auth.authenticate(remote_user=remote_user, tokens=False)
+
+    def test_skip_conflicting_users(self):
+        self.User.objects.create(id=100, username="user1")
+        out = self.import_users(self.remote_users)
+        self.assertIn("Created 4, updated 0, unchanged 0 and skipped 1 users", out)
+        self.assertFalse(self.User.objects.filter(id=1).exists())
+
+    def test_invalid_json(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".jsonl") as f:
+            f.write(json.dumps(self.remote_users[0]) + "\n\n{")
+            f.flush()
+            with self.assertRaisesMessage(CommandError, "line 3"):
+                call_command("import_platform_users", f.name, stdout=StringIO())
+
+    def test_missing_file(self):
+        with self.assertRaises(CommandError):
+            call_command("import_platform_users", "missing.jsonl", stdout=StringIO())
+
+
+class PurgeAccountsTestCase(TestCase):
+    def setUp(self):
+        self.User = get_user_model()
+        now = timezone.now()
+        for pennid, days in enumerate([-1, 10, 40, 50, 60], 1):
+            user = self.User.objects.create(
+                id=pennid, username=f"user{pennid}", last_login=now - timedelta(days)
+            )
+            Credential.objects.create(
+                user=user, access_token="abc", expires_at=now - timedelta(days)
+            )
+
+    def purge(self, *args):
+        out = StringIO()
+        call_command("purge_accounts", *args, "--sleep", "0", stdout=out)
+        return out.getvalue()
+
+    def test_purge_credentials(self):
+        out = self.purge("--batch-size", "2")
+        self.assertIn("Deleted 3 expired credentials and 0 dormant users", out)
+        self.assertEqual(
+            [1, 2], list(Credential.objects.order_by("pk").values_list("pk", flat=True))
+        )
+        self.assertEqual(5, self.User.objects.count())
+
+    def test_grace_days(self):
+        out = self.purge("--grace-days", "0")
+        self.assertIn("Deleted 4 expired credentials", out)
+
+    def test_dormant_users(self):
+        self.User.objects.filter(id=5).update(is_staff=True)
+        self.User.objects.create(id=6, username="user6")
+        out = self.purge("--dormant-days", "45", "--batch-size", "1")
+        self.assertIn("Deleted 3 expired credentials and 1 dormant users", out)
+        self.assertEqual(
+            [1, 2, 3, 5, 6],
+            list(self.User.objects.order_by("pk").values_list("pk", flat=True)),
+        )
+
+    def test_recently_seen_users_kept(self):
+        # Authenticated with a bearer token, which doesn't update last_login
+        PlatformProfile.objects.create(
+            user_id=4, fingerprint="", last_seen=timezone.now()
+        )
+        out = self.purge("--dormant-days", "45")
+        self.assertIn("Deleted 3 expired credentials and 1 dormant users", out)
+        self.assertTrue(self.User.objects.filter(id=4).exists())
+        self.assertFalse(self.User.objects.filter(id=5).exists())
+
+    def test_dry_run(self):
+        out = self.purge("--dormant-days", "45", "--dry-run")
+        self.assertIn("Would delete 3 expired credentials and 2 dormant users", out)
+        self.assertEqual(5, Credential.objects.count())
+        self.assertEqual(5, self.User.objects.count())
+
+    def test_invalid_batch_size(self):
+        with self.assertRaises(CommandError):
+            self.purge("--batch-size", "0")
@@ -0,0 +1,111 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.db import connection
+from django.test import TestCase
+
+from accounts.backends import LabsUserBackend
+from accounts.groups import get_or_create_groups, group_cache
+
+
+class GetOrCreateGroupsTestCase(TestCase):
+    def setUp(self):
+        self.student, _ = Group.objects.get_or_create(name="platform_student")
+
+    def test_get_or_create_groups(self):
+        with self.assertNumQueries(3):
+            groups = get_or_create_groups(Group, ["platform_student", "platform_new"])
+        new = Group.objects.get(name="platform_new")
+        self.assertEqual(
+            {"platform_student": self.student.pk, "platform_new": new.pk}, groups
+        )
+
+    def test_existing_groups(self):
+        with self.assertNumQueries(1):
+            groups = get_or_create_groups(Group, ["platform_student"])
+        self.assertEqual({"platform_student": self.student.pk}, groups)
+
+
+class GroupCacheTestCase(TestCase):
+    def setUp(self):
+        group_cache.clear()
+        self.addCleanup(group_cache.clear)
+        self.student, _ = Group.objects.get_or_create(name="platform_student")
+        self.staff, _ = Group.objects.get_or_create(name="platform_staff")
+
+    def warm(self, names):
+        with self.captureOnCommitCallbacks(execute=True):
+            return group_cache.get_pks(names)
+
+    def test_warm(self):
+        with self.assertNumQueries(1):
+            groups = self.warm(["platform_student"])
+        self.assertEqual({"platform_student": self.student.pk}, groups)
+        # Every platform group was loaded
+        with self.assertNumQueries(0):
+            groups = group_cache.get_pks(["platform_student", "platform_staff"])
+        self.assertEqual(
+            {"platform_student": self.student.pk, "platform_staff": self.staff.pk},
+            groups,
+        )
+
+    def test_create_group(self):
+        self.warm([])
+        groups = self.warm(["platform_new"])
+        new = Group.objects.get(name="platform_new")
+        self.assertEqual({"platform_new": new.pk}, groups)
+        with self.assertNumQueries(0):
+            self.assertEqual(groups, group_cache.get_pks(["platform_new"]))
+
+    def test_not_cached_until_commit(self):
+        group_cache.get_pks(["platform_student"])
+        with self.assertNumQueries(1):
+            group_cache.get_pks(["platform_student"])
+
+    def test_rename_group(self):
+        self.warm([])
+        self.student.name = "platform_undergraduate"
+        self.student.save()
+        groups = self.warm(["platform_student", "platform_undergraduate"])
+        self.assertEqual(self.student.pk, groups["platform_undergraduate"])
+        self.assertNotEqual(self.student.pk, groups["platform_student"])
+
+    def test_delete_group(self):
+        self.warm([])
+        self.staff.delete()
+        groups = self.warm(["platform_staff"])
+        self.assertTrue(Group.objects.filter(pk=groups["platform_staff"]).exists())
+
+    def delete_elsewhere(self, group):
+        # Delete a group without signals, as another process would
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM auth_group WHERE id = %s", [group.pk])
+
+    def test_verify(self):
+        self.warm([])
+        groups = {"platform_student": self.student.pk}
+        with self.assertNumQueries(1):
+            self.assertEqual(groups, group_cache.verify(groups))
+
+    def test_verify_deleted_elsewhere(self):
+        self.warm([])
+        self.delete_elsewhere(self.student)
+        groups = group_cache.verify({"platform_student": self.student.pk})
+        new = Group.objects.get(name="platform_student")
+        self.assertEqual({"platform_student": new.pk}, groups)
+        self.assertNotIn(self.student.pk, group_cache._pks.values())
+
+    def test_verify_renamed_elsewhere(self):
+        self.warm([])
+        Group.objects.filter(pk=self.student.pk).update(name="platform_other")
+        groups = group_cache.verify({"platform_student": self.student.pk})
+        self.assertNotEqual(self.student.pk, groups["platform_student"])
+
+    def test_sync_groups_after_delete_elsewhere(self):
+        user = get_user_model().objects.create(username="user")
+        self.warm([])
+        self.delete_elsewhere(self.student)
+        with self.captureOnCommitCallbacks(execute=True):
+            LabsUserBackend().sync_groups(user, ["student"])
+        self.assertEqual(
+            ["platform_student"], [group.name for group in user.groups.all()]
+        )
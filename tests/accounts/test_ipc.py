@@ -1,13 +1,28 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
-from unittest.mock import patch
+from io import StringIO
+from unittest.mock import Mock, patch
 
+import httpx
 import requests
 from django.contrib.auth import get_user_model
-from django.test import Client, TestCase
+from django.core.cache import cache
+from django.db import connection, connections
+from django.test import Client, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
-from accounts.ipc import _refresh_access_token, authenticated_request
-from accounts.models import AccessToken, RefreshToken
+from accounts.ipc import (
+    _refresh_access_token,
+    aauthenticated_request,
+    aauthenticated_requests,
+    authenticated_request,
+)
+from accounts.models import AccessToken, Credential, RefreshToken
+from accounts.settings import accounts_settings
+from accounts.utils import for_write
 
 
 class AuthenticatedRequestTestCase(TestCase):
@@ -26,8 +41,16 @@ class AuthenticatedRequestTestCase(TestCase):
         response = authenticated_request(self.user, None, None)
         self.assertEqual(403, response.status_code)
 
+    @patch("accounts.ipc.ipc_sessions.get")
+    def test_purged_user(self, mock_session):
+        Credential.objects.filter(user=self.user).delete()
+        user = get_user_model().objects.get(pk=self.user.pk)
+        response = authenticated_request(user, "GET", "https://example.com")
+        self.assertEqual(403, response.status_code)
+        mock_session.return_value.request.assert_not_called()
+
     @patch("accounts.ipc._refresh_access_token")
-    @patch("accounts.ipc.requests.Session")
+    @patch("accounts.ipc.ipc_sessions.get")
     def test_authorization_header(self, mock_session, mock_refresh):
         mock_refresh.return_value = True
         header = {"abc": "123"}
@@ -37,7 +60,395 @@ class AuthenticatedRequestTestCase(TestCase):
         self.assertEqual(header, arguments["headers"])
 
 
-@patch("accounts.ipc.requests.post")
+@patch("accounts.ipc.ipc_sessions.get")
+class PooledRequestTestCase(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create(username="abc")
+        Credential.objects.create(
+            user=self.user,
+            access_token="old",
+            expires_at=timezone.now() + timedelta(hours=1),
+            refresh_token="old",
+        )
+        self.url = "https://example.com/api/"
+
+    def test_pooled_session(self, mock_session):
+        authenticated_request(self.user, "GET", self.url)
+        mock_session.assert_called_once_with(self.url)
+
+    def test_default_timeout(self, mock_session):
+        authenticated_request(self.user, "GET", self.url)
+        arguments = mock_session.return_value.request.call_args[1]
+        self.assertEqual((5, 30), arguments["timeout"])
+
+    def test_timeout_and_auth(self, mock_session):
+        auth = ("user", "password")
+        authenticated_request(self.user, "GET", self.url, timeout=3, auth=auth)
+        arguments = mock_session.return_value.request.call_args[1]
+        self.assertEqual(3, arguments["timeout"])
+        self.assertEqual(auth, arguments["auth"])
+
+    @patch("accounts.ipc.platform_client.post")
+    def test_unauthorized_refreshes_once(self, mock_post, mock_session):
+        mock_post.return_value.status_code = 200
+        mock_post.return_value.json.return_value = {
+            "access_token": "new",
+            "refresh_token": "new",
+            "expires_in": 100,
+        }
+        mock_session.return_value.request.side_effect = [
+            Mock(status_code=401),
+            Mock(status_code=200),
+        ]
+        response = authenticated_request(self.user, "POST", self.url, data={"a": 1})
+        self.assertEqual(200, response.status_code)
+        mock_post.assert_called_once()
+        calls = mock_session.return_value.request.call_args_list
+        self.assertEqual("Bearer old", calls[0][1]["headers"]["Authorization"])
+        self.assertEqual("Bearer new", calls[1][1]["headers"]["Authorization"])
+
+    @patch("accounts.ipc.platform_client.post")
+    def test_unauthorized_after_refresh(self, mock_post, mock_session):
+        mock_post.return_value.status_code = 200
+        mock_post.return_value.json.return_value = {
+            "access_token": "new",
+            "refresh_token": "new",
+            "expires_in": 100,
+        }
+        mock_session.return_value.request.return_value = Mock(status_code=401)
+        response = authenticated_request(self.user, "GET", self.url)
+        self.assertEqual(401, response.status_code)
+        self.assertEqual(2, mock_session.return_value.request.call_count)
+
+    @patch("accounts.ipc.platform_client.post")
+    def test_unauthorized_refresh_failed(self, mock_post, mock_session):
+        mock_post.return_value.status_code = 400
+        mock_session.return_value.request.return_value = Mock(status_code=401)
+        response = authenticated_request(self.user, "GET", self.url)
+        self.assertEqual(403, response.status_code)
+        mock_session.return_value.request.assert_called_once()
+
+    @patch("accounts.ipc.platform_client.post")
+    def test_unauthorized_with_files(self, mock_post, mock_session):
+        mock_session.return_value.request.return_value = Mock(status_code=401)
+        files = {"file": StringIO("abc")}
+        response = authenticated_request(self.user, "POST", self.url, files=files)
+        self.assertEqual(401, response.status_code)
+        mock_post.assert_not_called()
+
+
+class AsyncAuthenticatedRequestTestCase(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create(username="abc")
+        Credential.objects.create(
+            user=self.user,
+            access_token="old",
+            expires_at=timezone.now() + timedelta(hours=1),
+            refresh_token="old",
+        )
+        self.requests = []
+        self.responses = {}
+        client = httpx.AsyncClient(transport=httpx.MockTransport(self.handle))
+        patcher = patch("accounts.ipc.async_ipc_client", Mock(client=client))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def handle(self, request):
+        self.requests.append(request)
+        status = self.responses.get(request.headers["Authorization"], {})
+        if isinstance(status, dict):
+            status = status.get(request.url.path, 200)
+        if isinstance(status, Exception):
+            raise status
+        if isinstance(status, httpx.Response):
+            return status
+        return httpx.Response(status)
+
+    def mock_refresh(self, mock_post):
+        mock_post.return_value.status_code = 200
+        mock_post.return_value.json.return_value = {
+            "access_token": "new",
+            "refresh_token": "new",
+            "expires_in": 100,
+        }
+
+    async def expire(self):
+        self.user.credential.expires_at = timezone.now()
+        await self.user.credential.asave(update_fields=["expires_at"])
+
+    async def test_authorization_header(self):
+        response = await aauthenticated_request(
+            self.user, "GET", "https://example.com/", headers={"abc": "123"}
+        )
+        self.assertEqual(200, response.status_code)
+        self.assertEqual("Bearer old", self.requests[0].headers["Authorization"])
+        self.assertEqual("123", self.requests[0].headers["abc"])
+
+    @patch("accounts.ipc.platform_client.post")
+    async def test_expired_token_refreshed(self, mock_post):
+        self.mock_refresh(mock_post)
+        await self.expire()
+        await aauthenticated_request(self.user, "GET", "https://example.com/")
+        mock_post.assert_called_once()
+        self.assertEqual("Bearer new", self.requests[0].headers["Authorization"])
+
+    @patch("accounts.ipc.platform_client.post")
+    async def test_refresh_failed(self, mock_post):
+        mock_post.return_value.status_code = 400
+        await self.expire()
+        response = await aauthenticated_request(
+            self.user, "GET", "https://example.com/"
+        )
+        self.assertEqual(403, response.status_code)
+        self.assertEqual([], self.requests)
+
+    @patch("accounts.ipc.platform_client.post")
+    async def test_unauthorized_refreshes_once(self, mock_post):
+        self.mock_refresh(mock_post)
+        self.responses["Bearer old"] = 401
+        response = await aauthenticated_request(
+            self.user, "POST", "https://example.com/", json={"a": 1}
+        )
+        self.assertEqual(200, response.status_code)
+        mock_post.assert_called_once()
+        self.assertEqual(2, len(self.requests))
+        self.assertEqual(self.requests[0].content, self.requests[1].content)
+
+    @patch("accounts.ipc.platform_client.post")
+    async def test_fan_out(self, mock_post):
+        self.mock_refresh(mock_post)
+        await self.expire()
+        self.responses["Bearer new"] = {
+            "/missing/": 404,
+            "/timeout/": httpx.ReadTimeout("timed out"),
+        }
+        results = await aauthenticated_requests(
+            self.user,
+            [
+                ("GET", f"https://example.com/{path}/", {})
+                for path in ["a", "missing", "timeout", "b"]
+            ],
+        )
+        mock_post.assert_called_once()
+        self.assertEqual(200, results[0].status_code)
+        self.assertEqual(404, results[1].status_code)
+        self.assertIsInstance(results[2], httpx.ReadTimeout)
+        self.assertEqual(200, results[3].status_code)
+
+    @patch("accounts.ipc.platform_client.post")
+    async def test_fan_out_unauthorized_shares_refresh(self, mock_post):
+        self.mock_refresh(mock_post)
+        self.responses["Bearer old"] = 401
+        results = await aauthenticated_requests(
+            self.user,
+            [("GET", f"https://example.com/{i}/", {}) for i in range(3)],
+        )
+        self.assertEqual([200, 200, 200], [r.status_code for r in results])
+        mock_post.assert_called_once()
+
+    @patch("accounts.ipc.platform_client.post")
+    async def test_fan_out_refresh_failed(self, mock_post):
+        mock_post.return_value.status_code = 400
+        await self.expire()
+        results = await aauthenticated_requests(
+            self.user, [("GET", "https://example.com/", {})] * 2
+        )
+        self.assertEqual([403, 403], [r.status_code for r in results])
+        self.assertEqual([], self.requests)
+
+    async def test_fan_out_purged_user(self):
+        await Credential.objects.filter(user=self.user).adelete()
+        user = await get_user_model().objects.aget(pk=self.user.pk)
+        results = await aauthenticated_requests(
+            user, [("GET", "https://example.com/", {})] * 2
+        )
+        self.assertEqual([403, 403], [r.status_code for r in results])
+        self.assertEqual([], self.requests)
+
+    @patch.object(accounts_settings, "IPC_CACHE", "default")
+    async def test_cached_responses(self):
+        cache.clear()
+        self.responses["Bearer old"] = {
+            "/fresh/": httpx.Response(200, headers={"Cache-Control": "max-age=60"}),
+            "/etag/": httpx.Response(200, headers={"ETag": '"v1"'}, content=b"a"),
+        }
+        calls = [
+            ("GET", "https://example.com/fresh/", {}),
+            ("GET", "https://example.com/etag/", {"cache": "public"}),
+            ("POST", "https://example.com/fresh/", {}),
+        ]
+        await aauthenticated_requests(self.user, calls)
+        self.responses["Bearer old"]["/etag/"] = httpx.Response(304)
+        results = await aauthenticated_requests(self.user, calls)
+        self.assertEqual([200, 200, 200], [r.status_code for r in results])
+        self.assertEqual(b"a", results[1].content)
+        paths = [request.url.path for request in self.requests]
+        self.assertEqual(["/etag/", "/fresh/"], paths[3:])
+        self.assertEqual('"v1"', self.requests[3].headers["If-None-Match"])
+
+
+def make_response(status, headers=None, content=b""):
+    response = requests.models.Response()
+    response.status_code = status
+    response.headers.update(headers or {})
+    response._content = content
+    response._content_consumed = True
+    return response
+
+
+@patch.object(accounts_settings, "IPC_CACHE", "default")
+@patch("accounts.ipc.ipc_sessions.get")
+class ResponseCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create(username="abc")
+        self.other = get_user_model().objects.create(username="def")
+        for user in [self.user, self.other]:
+            Credential.objects.create(
+                user=user,
+                access_token=user.username,
+                expires_at=timezone.now() + timedelta(hours=1),
+                refresh_token=user.username,
+            )
+        self.url = "https://example.com/api/courses/"
+
+    def test_fresh_response(self, mock_session):
+        request = mock_session.return_value.request
+        request.return_value = make_response(
+            200, {"Cache-Control": "max-age=60"}, b"courses"
+        )
+        authenticated_request(self.user, "GET", self.url, params={"a": 1})
+        response = authenticated_request(self.user, "GET", self.url, params={"a": 1})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(b"courses", response.content)
+        request.assert_called_once()
+
+    def test_cached_per_user(self, mock_session):
+        request = mock_session.return_value.request
+        request.return_value = make_response(200, {"Cache-Control": "max-age=60"})
+        authenticated_request(self.user, "GET", self.url)
+        authenticated_request(self.other, "GET", self.url)
+        authenticated_request(self.user, "GET", self.url, params={"a": 1})
+        self.assertEqual(3, request.call_count)
+
+    def test_public(self, mock_session):
+        request = mock_session.return_value.request
+        request.return_value = make_response(200, {"Cache-Control": "max-age=60"})
+        authenticated_request(self.user, "GET", self.url, cache="public")
+        authenticated_request(self.other, "GET", self.url, cache="public")
+        request.assert_called_once()
+
+    def test_private_response_not_shared(self, mock_session):
+        request = mock_session.return_value.request
+        request.return_value = make_response(
+            200, {"Cache-Control": "private, max-age=60"}
+        )
+        authenticated_request(self.user, "GET", self.url, cache="public")
+        authenticated_request(self.other, "GET", self.url, cache="public")
+        self.assertEqual(2, request.call_count)
+
+    def test_revalidate(self, mock_session):
+        request = mock_session.return_value.request
+        request.side_effect = [
+            make_response(200, {"ETag": '"v1"'}, b"courses"),
+            make_response(304, {"ETag": '"v1"'}),
+        ]
+        authenticated_request(self.user, "GET", self.url)
+        response = authenticated_request(self.user, "GET", self.url)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(b"courses", response.content)
+        headers = request.call_args[1]["headers"]
+        self.assertEqual('"v1"', headers["If-None-Match"])
+        self.assertEqual("Bearer abc", headers["Authorization"])
+
+    def test_changed_response_replaces_entry(self, mock_session):
+        request = mock_session.return_value.request
+        request.side_effect = [
+            make_response(200, {"ETag": '"v1"'}, b"old"),
+            make_response(200, {"ETag": '"v2"'}, b"new"),
+            make_response(304, {"ETag": '"v2"'}),
+        ]
+        for _ in range(3):
+            response = authenticated_request(self.user, "GET", self.url)
+        self.assertEqual(b"new", response.content)
+        self.assertEqual('"v2"', request.call_args[1]["headers"]["If-None-Match"])
+
+    def test_uncacheable_requests(self, mock_session):
+        request = mock_session.return_value.request
+        request.return_value = make_response(200, {"Cache-Control": "max-age=60"})
+        for _ in range(2):
+            authenticated_request(self.user, "POST", self.url)
+            authenticated_request(self.user, "GET", self.url, cache=None)
+            authenticated_request(self.user, "GET", self.url, stream=True)
+            authenticated_request(self.user, "GET", self.url, cookies={"a": "b"})
+        self.assertEqual(8, request.call_count)
+
+    def test_error_not_cached(self, mock_session):
+        request = mock_session.return_value.request
+        request.return_value = make_response(404, {"Cache-Control": "max-age=60"})
+        authenticated_request(self.user, "GET", self.url)
+        authenticated_request(self.user, "GET", self.url)
+        self.assertEqual(2, request.call_count)
+
+    def test_disabled(self, mock_session):
+        request = mock_session.return_value.request
+        request.return_value = make_response(200, {"Cache-Control": "max-age=60"})
+        with patch.object(accounts_settings, "IPC_CACHE", None):
+            authenticated_request(self.user, "GET", self.url)
+            authenticated_request(self.user, "GET", self.url)
+        self.assertEqual(2, request.call_count)
+
+
+class ReadDatabaseTestCase(TestCase):
+    databases = {"default", "replica"}
+
+    def setUp(self):
+        self.user = get_user_model().objects.create(username="abc")
+        self.now = timezone.now()
+        AccessToken.objects.create(
+            user=self.user, expires_at=self.now + timedelta(hours=1), token="new"
+        )
+        RefreshToken.objects.create(user=self.user)
+
+    @patch("accounts.ipc._refresh_access_token")
+    @patch("accounts.ipc.ipc_sessions.get")
+    def test_stale_replica_token(self, mock_session, mock_refresh):
+        user = get_user_model().objects.get(pk=self.user.pk)
+        # Simulate a token read from a replica that hasn't seen the last refresh
+        user.credential._state.db = "replica"
+        user.credential.expires_at = self.now - timedelta(hours=1)
+        user.credential.access_token = "old"
+        authenticated_request(user, "GET", "https://example.com")
+        mock_refresh.assert_not_called()
+        self.assertEqual("default", user.credential._state.db)
+        arguments = mock_session.return_value.request.call_args[1]
+        self.assertEqual("Bearer new", arguments["headers"]["Authorization"])
+
+
+@patch.object(accounts_settings, "READ_DATABASE", "replica")
+class ReplicaTokenTestCase(TransactionTestCase):
+    databases = {"default", "replica"}
+
+    def setUp(self):
+        self.user = get_user_model().objects.create(username="abc")
+        AccessToken.objects.create(
+            user=self.user, expires_at=timezone.now() + timedelta(hours=1), token="new"
+        )
+
+    @patch("accounts.ipc.ipc_sessions.get")
+    def test_token_read_from_replica(self, mock_session):
+        user = for_write(get_user_model().objects.get(pk=self.user.pk))
+        with CaptureQueriesContext(
+            connections["default"]
+        ) as primary, CaptureQueriesContext(connections["replica"]) as replica:
+            authenticated_request(user, "GET", "https://example.com")
+        self.assertEqual(0, len(primary))
+        self.assertEqual(1, len(replica))
+        arguments = mock_session.return_value.request.call_args[1]
+        self.assertEqual("Bearer new", arguments["headers"]["Authorization"])
+
+
+@patch("accounts.ipc.platform_client.post")
 class RefreshAccessTokenTestCase(TestCase):
     def setUp(self):
         self.client = Client()
@@ -57,13 +468,41 @@ class RefreshAccessTokenTestCase(TestCase):
         value = _refresh_access_token(self.user)
         diff = self.now + timedelta(seconds=self.valid_response["expires_in"])
         self.assertTrue(value)
-        self.assertTrue(diff < self.user.accesstoken.expires_at)
+        self.assertTrue(diff < self.user.credential.expires_at)
         self.assertEqual(
-            self.valid_response["access_token"], self.user.accesstoken.token
+            self.valid_response["access_token"], self.user.credential.access_token
         )
         self.assertEqual(
-            self.valid_response["refresh_token"], self.user.refreshtoken.token
+            self.valid_response["refresh_token"], self.user.credential.refresh_token
+        )
+        # The tokens are also visible through the backwards compatible models
+        self.assertEqual(
+            self.valid_response["access_token"],
+            AccessToken.objects.get(user=self.user).token,
+        )
+        self.assertEqual(
+            self.valid_response["refresh_token"],
+            RefreshToken.objects.get(user=self.user).token,
+        )
+
+    def test_single_row_update(self, mock_post):
+        mock_post.return_value.status_code = 200
+        mock_post.return_value.json.return_value = self.valid_response
+        user = get_user_model().objects.get(pk=self.user.pk)
+        with CaptureQueriesContext(connection) as queries:
+            _refresh_access_token(user)
+        updates = [q for q in queries.captured_queries if q["sql"].startswith("UPDATE")]
+        self.assertEqual(1, len(updates))
+
+    def test_refreshed_by_another_process(self, mock_post):
+        user = get_user_model().objects.get(pk=self.user.pk)
+        user.credential  # Load the expired credential
+        Credential.objects.filter(user=self.user).update(
+            access_token="new", expires_at=self.now + timedelta(hours=1)
         )
+        self.assertTrue(_refresh_access_token(user))
+        mock_post.assert_not_called()
+        self.assertEqual("new", user.credential.access_token)
 
     def test_invalid_response(self, mock_post):
         mock_post.return_value.status_code = 403
@@ -80,3 +519,45 @@ class RefreshAccessTokenTestCase(TestCase):
         self.assertNotEqual(
             self.valid_response["refresh_token"], self.user.refreshtoken.token
         )
+
+
+@patch("accounts.ipc.platform_client.post")
+class ConcurrentRefreshTestCase(TransactionTestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create(username="abc")
+        Credential.objects.create(
+            user=self.user,
+            access_token="old",
+            expires_at=timezone.now(),
+            refresh_token="old",
+        )
+
+    def test_single_refresh(self, mock_post):
+        threads = 8
+        barrier = threading.Barrier(threads)
+
+        def post(*args, **kwargs):
+            time.sleep(0.1)
+            response = Mock(status_code=200)
+            response.json.return_value = {
+                "access_token": "new",
+                "refresh_token": "new",
+                "expires_in": 100,
+            }
+            return response
+
+        def refresh(_):
+            user = get_user_model().objects.get(pk=self.user.pk)
+            user.credential  # Load the expired credential
+            barrier.wait()
+            try:
+                return _refresh_access_token(user), user.credential.access_token
+            finally:
+                connection.close()
+
+        mock_post.side_effect = post
+        with ThreadPoolExecutor(threads) as executor:
+            results = list(executor.map(refresh, range(threads)))
+
+        mock_post.assert_called_once()
+        self.assertEqual([(True, "new")] * threads, results)
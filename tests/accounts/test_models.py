@@ -2,7 +2,40 @@ from django.contrib.auth import get_user_model
 from django.test import TestCase
 from django.utils import timezone
 
-from accounts.models import AccessToken, RefreshToken
+from accounts.models import AccessToken, Credential, PlatformProfile, RefreshToken
+from accounts.utils import hash_token
+
+
+class CredentialTestCase(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create(username="abc")
+        self.credential = Credential.objects.create(
+            user=self.user,
+            access_token="123",
+            expires_at=timezone.now(),
+            refresh_token="456",
+        )
+
+    def test_str(self):
+        self.assertEqual(str(self.credential), str(self.user.id))
+
+    def test_access_token_hash(self):
+        self.assertEqual(hash_token("123"), self.credential.access_token_hash)
+
+    def test_backwards_compatible_models(self):
+        user = get_user_model().objects.get(id=self.user.id)
+        self.assertEqual("123", user.accesstoken.token)
+        self.assertEqual(hash_token("123"), user.accesstoken.token_hash)
+        self.assertEqual("456", user.refreshtoken.token)
+        user.refreshtoken.token = "789"
+        user.refreshtoken.save()
+        self.credential.refresh_from_db()
+        self.assertEqual("123", self.credential.access_token)
+        self.assertEqual("789", self.credential.refresh_token)
+
+    def test_delete_user(self):
+        self.user.delete()
+        self.assertFalse(Credential.objects.exists())
 
 
 class AccessTokenTestCase(TestCase):
@@ -16,6 +49,13 @@ class AccessTokenTestCase(TestCase):
     def test_str(self):
         self.assertEqual(str(self.accesstoken), self.token)
 
+    def test_token_hash(self):
+        self.assertEqual(hash_token(self.token), self.accesstoken.token_hash)
+        self.accesstoken.token = "456"
+        self.accesstoken.save(update_fields=["token"])
+        self.accesstoken.refresh_from_db()
+        self.assertEqual(hash_token("456"), self.accesstoken.token_hash)
+
 
 class RefreshTokenTestCase(TestCase):
     def setUp(self):
@@ -27,3 +67,15 @@ class RefreshTokenTestCase(TestCase):
 
     def test_str(self):
         self.assertEqual(str(self.refreshtoken), self.token)
+
+
+class PlatformProfileTestCase(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create(username="abc")
+        self.fingerprint = "123"
+        self.profile = PlatformProfile.objects.create(
+            user=self.user, fingerprint=self.fingerprint
+        )
+
+    def test_str(self):
+        self.assertEqual(str(self.profile), self.fingerprint)
@@ -0,0 +1,97 @@
+from unittest.mock import patch
+
+import requests
+from asgiref.sync import async_to_sync
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase
+from requests.cookies import MockRequest, create_cookie
+
+from accounts.platform import AsyncIPCClient, HostSessionPool, PlatformClient
+from accounts.settings import accounts_settings
+
+
+class PlatformClientTestCase(TestCase):
+    def setUp(self):
+        self.client = PlatformClient()
+
+    def test_shared_session(self):
+        self.assertIs(self.client.session, self.client.session)
+        self.assertIs(self.client.adapter, self.client.session.get_adapter("https://"))
+
+    def test_pool_size(self):
+        with patch.object(accounts_settings, "PLATFORM_POOL_SIZE", 3):
+            self.assertEqual(3, self.client.adapter._pool_maxsize)
+
+    def test_cookies_not_stored(self):
+        cookies = self.client.session.cookies
+        request = requests.Request("GET", accounts_settings.PLATFORM_URL).prepare()
+        cookie = create_cookie("sessionid", "abc", domain="platform.pennlabs.org")
+        cookies.set_cookie_if_ok(cookie, MockRequest(request))
+        self.assertEqual(0, len(cookies))
+
+    @patch("accounts.platform.requests.Session.request")
+    def test_request_timeout(self, mock_request):
+        self.client.post("/accounts/token/", data={})
+        mock_request.assert_called_with(
+            "POST",
+            accounts_settings.PLATFORM_URL + "/accounts/token/",
+            data={},
+            timeout=(
+                accounts_settings.PLATFORM_CONNECT_TIMEOUT,
+                accounts_settings.PLATFORM_READ_TIMEOUT,
+            ),
+        )
+
+    @patch("accounts.platform.requests.Session.request")
+    def test_introspect(self, mock_request):
+        self.client.introspect("abc")
+        arguments = mock_request.call_args[1]
+        self.assertEqual({"Authorization": "Bearer abc"}, arguments["headers"])
+        self.assertEqual({"token": "abc"}, arguments["data"])
+
+    def test_oauth_session_shares_pool(self):
+        session = self.client.oauth_session(state="abc")
+        self.assertIs(self.client.adapter, session.get_adapter("https://"))
+        self.assertEqual(accounts_settings.CLIENT_ID, session.client_id)
+
+
+class HostSessionPoolTestCase(TestCase):
+    def setUp(self):
+        self.pool = HostSessionPool()
+
+    def test_session_per_host(self):
+        session = self.pool.get("https://example.com/a/")
+        self.assertIs(session, self.pool.get("https://example.com/b/?c=d"))
+        self.assertIsNot(session, self.pool.get("https://other.example.com/"))
+        self.assertIsNot(session, self.pool.get("http://example.com/"))
+
+    def test_retries(self):
+        with patch.object(accounts_settings, "IPC_RETRIES", 3):
+            adapter = self.pool.get("https://example.com/").get_adapter("https://")
+        retries = adapter.max_retries
+        self.assertEqual(3, retries.total)
+        self.assertTrue(retries.is_retry("GET", 503))
+        self.assertFalse(retries.is_retry("POST", 503))
+        self.assertFalse(retries.is_retry("GET", 500))
+
+    def test_close(self):
+        session = self.pool.get("https://example.com/")
+        self.pool.close()
+        self.assertIsNot(session, self.pool.get("https://example.com/"))
+
+
+class AsyncIPCClientTestCase(TestCase):
+    async def test_client_per_loop(self):
+        ipc_client = AsyncIPCClient()
+        client = ipc_client.client
+        self.assertIs(client, ipc_client.client)
+        self.assertEqual(5, client.timeout.connect)
+        self.assertEqual(30, client.timeout.read)
+
+    def test_httpx_required(self):
+        async def get_client():
+            return AsyncIPCClient().client
+
+        with patch("accounts.platform.httpx", None):
+            with self.assertRaises(ImproperlyConfigured):
+                async_to_sync(get_client)()
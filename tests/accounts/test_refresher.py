@@ -0,0 +1,78 @@
+import threading
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import Mock, patch
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TransactionTestCase
+from django.utils import timezone
+
+from accounts.models import Credential
+from accounts.refresher import TokenRefresher, refresh_expiring_tokens
+from accounts.settings import accounts_settings
+
+
+@patch("accounts.ipc.platform_client.post")
+class RefreshExpiringTokensTestCase(TransactionTestCase):
+    def setUp(self):
+        now = timezone.now()
+        # Expired, expiring soon, expiring soon without a refresh token, and valid
+        for pennid, (seconds, refresh_token) in enumerate(
+            [(-60, "old"), (60, "old"), (120, "old"), (120, None), (3600, "old")], 1
+        ):
+            user = get_user_model().objects.create(id=pennid, username=f"user{pennid}")
+            Credential.objects.create(
+                user=user,
+                access_token="old",
+                expires_at=now + timedelta(seconds=seconds),
+                refresh_token=refresh_token,
+            )
+        self.response = Mock(status_code=200)
+        self.response.json.return_value = {
+            "access_token": "new",
+            "refresh_token": "new",
+            "expires_in": 36000,
+        }
+
+    def get_refreshed(self):
+        return list(
+            Credential.objects.filter(access_token="new")
+            .order_by("pk")
+            .values_list("pk", flat=True)
+        )
+
+    def test_refresh_expiring_tokens(self, mock_post):
+        mock_post.return_value = self.response
+        self.assertEqual((2, 0), refresh_expiring_tokens(300, 2, batch_size=1))
+        self.assertEqual(2, mock_post.call_count)
+        self.assertEqual([2, 3], self.get_refreshed())
+
+    def test_refresh_failed(self, mock_post):
+        mock_post.return_value = Mock(status_code=400)
+        self.assertEqual((0, 2), refresh_expiring_tokens(300, 2))
+        self.assertEqual([], self.get_refreshed())
+
+    def test_refresh_tokens_command(self, mock_post):
+        mock_post.return_value = self.response
+        out = StringIO()
+        call_command("refresh_tokens", "--window", "90", stdout=out)
+        self.assertIn("Refreshed 1 and failed to refresh 0 tokens", out.getvalue())
+        self.assertEqual([2], self.get_refreshed())
+
+    @patch.object(accounts_settings, "TOKEN_REFRESH_INTERVAL", 0.01)
+    def test_token_refresher(self, mock_post):
+        refreshed = threading.Event()
+
+        def post(*args, **kwargs):
+            refreshed.set()
+            return self.response
+
+        mock_post.side_effect = post
+        refresher = TokenRefresher()
+        refresher.start()
+        try:
+            self.assertTrue(refreshed.wait(5))
+        finally:
+            refresher.stop()
+        self.assertFalse(refresher._thread.is_alive())
@@ -0,0 +1,86 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.test import SimpleTestCase
+
+from accounts.singleflight import AsyncSingleFlight, SingleFlight
+
+
+class SingleFlightTestCase(SimpleTestCase):
+    def setUp(self):
+        self.flight = SingleFlight()
+        self.release = threading.Event()
+        self.calls = 0
+
+    def work(self):
+        self.calls += 1
+        self.release.wait(5)
+        return "result"
+
+    def waiting(self):
+        call = self.flight._calls.get("key")
+        return len(call.done._cond._waiters) if call else 0
+
+    def test_single_call(self):
+        self.release.set()
+        self.assertEqual(("result", False), self.flight.do("key", self.work))
+
+    def test_concurrent_calls_coalesced(self):
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            futures = [
+                executor.submit(self.flight.do, "key", self.work) for _ in range(5)
+            ]
+            # Wait until the other callers are waiting on the first call
+            while self.waiting() < 4:
+                time.sleep(0.01)
+            self.release.set()
+            results = [future.result() for future in futures]
+        self.assertEqual(1, self.calls)
+        self.assertEqual(["result"] * 5, [result for result, _ in results])
+        self.assertEqual(4, sum(shared for _, shared in results))
+
+    def test_different_keys(self):
+        self.release.set()
+        self.flight.do("a", self.work)
+        self.flight.do("b", self.work)
+        self.assertEqual(2, self.calls)
+
+    def test_exception_shared(self):
+        def fail():
+            raise ValueError
+
+        with self.assertRaises(ValueError):
+            self.flight.do("key", fail)
+        self.assertEqual({}, self.flight._calls)
+
+
+class AsyncSingleFlightTestCase(SimpleTestCase):
+    def setUp(self):
+        self.flight = AsyncSingleFlight()
+        self.calls = 0
+
+    async def work(self):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def test_concurrent_calls_coalesced(self):
+        results = await asyncio.gather(
+            *[self.flight.do("key", self.work) for _ in range(5)]
+        )
+        self.assertEqual(1, self.calls)
+        self.assertEqual(["result"] * 5, [result for result, _ in results])
+        self.assertEqual(4, sum(shared for _, shared in results))
+
+    async def test_exception_shared(self):
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError
+
+        results = await asyncio.gather(
+            *[self.flight.do("key", fail) for _ in range(3)], return_exceptions=True
+        )
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+        self.assertEqual({}, self.flight._calls)
@@ -0,0 +1,70 @@
+from django.contrib import auth
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.test import TestCase
+
+from accounts.backends import LabsUserBackend
+from accounts.models import PlatformProfile
+from accounts.utils import (
+    get_platform_profile,
+    has_platform_group,
+    has_platform_permission,
+)
+
+
+class PlatformProfileHelpersTestCase(TestCase):
+    def setUp(self):
+        self.User = get_user_model()
+        self.remote_user = {
+            "pennid": 1,
+            "first_name": "First",
+            "last_name": "Last",
+            "username": "user",
+            "email": "test@test.com",
+            "affiliation": [],
+            "user_permissions": ["example_admin"],
+            "groups": ["student", "member"],
+        }
+
+    def test_authenticated_user(self):
+        user = auth.authenticate(remote_user=self.remote_user, tokens=False)
+        with self.assertNumQueries(0):
+            self.assertTrue(has_platform_group(user, "student"))
+            self.assertFalse(has_platform_group(user, "staff"))
+            self.assertTrue(has_platform_permission(user, "example_admin"))
+            self.assertFalse(has_platform_permission(user, "other_admin"))
+
+    def test_session_user(self):
+        auth.authenticate(remote_user=self.remote_user, tokens=False)
+        user = LabsUserBackend().get_user(1)
+        with self.assertNumQueries(0):
+            self.assertTrue(has_platform_group(user, "member"))
+
+    def test_changed_groups(self):
+        auth.authenticate(remote_user=self.remote_user, tokens=False)
+        self.remote_user["groups"] = ["alum"]
+        user = auth.authenticate(remote_user=self.remote_user, tokens=False)
+        self.assertTrue(has_platform_group(user, "alum"))
+        self.assertFalse(has_platform_group(user, "student"))
+        profile = PlatformProfile.objects.get(user=user)
+        self.assertEqual(["alum"], profile.groups)
+        self.assertEqual(["example_admin"], profile.permissions)
+
+    def test_list_of_users(self):
+        for pennid in range(1, 4):
+            self.remote_user.update(pennid=pennid, username=f"user{pennid}")
+            auth.authenticate(remote_user=self.remote_user, tokens=False)
+        with self.assertNumQueries(1):
+            users = self.User.objects.select_related("platformprofile")
+            self.assertTrue(all(has_platform_group(user, "student") for user in users))
+
+    def test_user_without_profile(self):
+        user = self.User.objects.create(username="other")
+        self.assertIsNone(get_platform_profile(user))
+        self.assertFalse(has_platform_group(user, "student"))
+        self.assertFalse(has_platform_permission(user, "example_admin"))
+
+    def test_anonymous_user(self):
+        with self.assertNumQueries(0):
+            self.assertFalse(has_platform_group(AnonymousUser(), "student"))
+            self.assertFalse(has_platform_permission(AnonymousUser(), "example_admin"))
@@ -65,7 +65,7 @@ class LoginViewTestCase(TestCase):
         self.assertIn("scope=" + "+".join(accounts_settings.SCOPE), response.url)
 
 
-@patch("accounts.views.OAuth2Session.post")
+@patch("accounts.views.platform_client.introspect")
 @patch("accounts.views.OAuth2Session.fetch_token")
 class CallbackViewTestCase(TestCase):
     def setUp(self):
@@ -201,8 +201,8 @@ class TokenViewTestCase(TestCase):
             }
         }
 
-    @patch("accounts.views.OAuth2Session.post")
-    @patch("accounts.views.requests.post")
+    @patch("accounts.views.platform_client.introspect")
+    @patch("accounts.views.platform_client.post")
     def test_token_valid(self, mock_requests_post, mock_oauth_post):
         mock_requests_post.return_value.json.return_value = self.mock_requests_json
         mock_requests_post.return_value.status_code = 200
@@ -235,8 +235,8 @@ class TokenViewTestCase(TestCase):
             self.mock_requests_json["refresh_token"], user.refreshtoken.token
         )
 
-    @patch("accounts.views.OAuth2Session.post")
-    @patch("accounts.views.requests.post")
+    @patch("accounts.views.platform_client.introspect")
+    @patch("accounts.views.platform_client.post")
     def test_token_unknown_user(self, mock_requests_post, mock_oauth_post):
         mock_requests_post.return_value.json.return_value = self.mock_requests_json
         mock_requests_post.return_value.status_code = 200
@@ -258,10 +258,12 @@ class TokenViewTestCase(TestCase):
         self.assertEqual(len(AccessToken.objects.all()), 1)
         self.assertEqual(len(RefreshToken.objects.all()), 1)
 
-    @patch("accounts.views.requests.post")
-    def test_token_invalid_introspect(self, mock_requests_post):
+    @patch("accounts.views.platform_client.introspect")
+    @patch("accounts.views.platform_client.post")
+    def test_token_invalid_introspect(self, mock_requests_post, mock_introspect):
         mock_requests_post.return_value.json.return_value = self.mock_requests_json
         mock_requests_post.return_value.status_code = 200
+        mock_introspect.return_value.status_code = 403
         payload = {
             "grant_type": "correct_grant_type",
             "client_id": "correct_client_id",
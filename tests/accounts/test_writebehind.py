@@ -0,0 +1,116 @@
+from unittest.mock import patch
+
+from django.contrib import auth
+from django.contrib.auth import get_user_model
+from django.test import TransactionTestCase
+
+from accounts.backends import LabsUserBackend, get_fingerprint
+from accounts.groups import group_cache
+from accounts.models import PlatformProfile
+from accounts.settings import accounts_settings
+from accounts.writebehind import WriteBehindQueue
+
+
+@patch.object(accounts_settings, "WRITE_BEHIND", True)
+class WriteBehindTestCase(TransactionTestCase):
+    def setUp(self):
+        # Groups are removed between transactional tests
+        group_cache.clear()
+        self.User = get_user_model()
+        self.remote_user = self.get_remote_user(1)
+        auth.authenticate(remote_user=self.remote_user, tokens=False)
+        # Use a new queue for each test so that no worker is running yet
+        self.queue = WriteBehindQueue()
+        patcher = patch("accounts.backends.write_behind", self.queue)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.queue.start()
+        self.queue.flush()
+
+    def get_remote_user(self, pennid):
+        return {
+            "pennid": pennid,
+            "first_name": "First",
+            "last_name": "Last",
+            "username": f"user{pennid}",
+            "email": "test@test.com",
+            "affiliation": [],
+            "user_permissions": [],
+            "groups": ["student", "member"],
+        }
+
+    def get_groups(self, user):
+        return list(user.groups.order_by("name").values_list("name", flat=True))
+
+    def test_created_user_written_immediately(self):
+        user = self.User.objects.get(id=1)
+        self.assertEqual("test@test.com", user.email)
+        self.assertEqual(["platform_member", "platform_student"], self.get_groups(user))
+        self.assertTrue(PlatformProfile.objects.filter(user=user).exists())
+
+    def test_profile_written_behind(self):
+        self.remote_user["email"] = "changed@test.com"
+        self.remote_user["groups"] = ["alum"]
+        with patch.object(self.queue, "start"):
+            user = auth.authenticate(remote_user=self.remote_user, tokens=False)
+            self.assertEqual("changed@test.com", user.email)
+            self.assertEqual(["alum"], user.platformprofile.groups)
+            # Nothing has been written yet
+            self.assertEqual("test@test.com", self.User.objects.get(id=1).email)
+        self.queue.start()
+        self.assertTrue(self.queue.flush(5))
+        user = self.User.objects.get(id=1)
+        self.assertEqual("changed@test.com", user.email)
+        self.assertEqual(["platform_alum"], self.get_groups(user))
+        self.assertEqual(
+            get_fingerprint(self.remote_user), user.platformprofile.fingerprint
+        )
+
+    def test_admin_written_immediately(self):
+        self.remote_user["email"] = "changed@test.com"
+        self.remote_user["user_permissions"] = ["example_admin"]
+        with patch.object(self.queue, "start"):
+            auth.authenticate(remote_user=self.remote_user, tokens=False)
+            user = self.User.objects.get(id=1)
+            self.assertTrue(user.is_staff)
+            self.assertTrue(user.is_superuser)
+            self.assertEqual("test@test.com", user.email)
+        self.queue.start()
+        self.assertTrue(self.queue.flush(5))
+        self.assertEqual("changed@test.com", self.User.objects.get(id=1).email)
+
+    @patch.object(LabsUserBackend, "sync_groups", autospec=True)
+    def test_coalesce_updates(self, mock_sync_groups):
+        with patch.object(self.queue, "start"):
+            for email in ["first@test.com", "second@test.com"]:
+                self.remote_user["email"] = email
+                auth.authenticate(remote_user=self.remote_user, tokens=False)
+        self.queue.start()
+        self.assertTrue(self.queue.flush(5))
+        self.assertEqual(1, mock_sync_groups.call_count)
+        self.assertEqual("second@test.com", self.User.objects.get(id=1).email)
+
+    @patch.object(accounts_settings, "WRITE_BEHIND_QUEUE_SIZE", 1)
+    def test_full_queue_writes_immediately(self):
+        auth.authenticate(remote_user=self.get_remote_user(2), tokens=False)
+        with patch.object(self.queue, "start"):
+            for pennid in [1, 2]:
+                remote_user = self.get_remote_user(pennid)
+                remote_user["email"] = "changed@test.com"
+                auth.authenticate(remote_user=remote_user, tokens=False)
+            self.assertEqual("test@test.com", self.User.objects.get(id=1).email)
+            self.assertEqual("changed@test.com", self.User.objects.get(id=2).email)
+        self.queue.start()
+        self.assertTrue(self.queue.flush(5))
+        self.assertEqual("changed@test.com", self.User.objects.get(id=1).email)
+
+    async def test_async_profile_written_behind(self):
+        self.remote_user["first_name"] = "Changed"
+        backend = LabsUserBackend()
+        user = await backend.aauthenticate(None, self.remote_user, tokens=False)
+        self.assertEqual("Changed", user.first_name)
+        self.assertTrue(self.queue.flush(5))
+        user = await self.User.objects.aget(id=1)
+        self.assertEqual("Changed", user.first_name)
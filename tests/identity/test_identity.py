@@ -12,6 +12,7 @@ from identity.identity import (
     authenticated_b2b_request,
     container,
     get_platform_jwks,
+    looks_like_jwt,
     validate_urn,
 )
 from tests.identity.utils import (
@@ -123,3 +124,13 @@ class AuthenticatedB2BRequestTestCase(TestCase):
         header["Authorization"] = f"Bearer {container.access_jwt.serialize()}"
         arguments = mock_session.return_value.request.call_args[1]
         self.assertEqual(header, arguments["headers"])
+
+
+class LooksLikeJWTTestCase(TestCase):
+    def test_jwt(self):
+        configure_container(self)
+        self.assertTrue(looks_like_jwt(container.access_jwt.serialize()))
+
+    def test_opaque_token(self):
+        self.assertFalse(looks_like_jwt("abc123"))
+        self.assertFalse(looks_like_jwt("a.b"))
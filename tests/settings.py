@@ -46,7 +46,18 @@ TEMPLATES = [
 ]
 
 DATABASES = {
-    "default": {"ENGINE": "django.db.backends.sqlite3", "NAME": "example.sqlite"}
+    "default": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": "example.sqlite",
+        # Use a file rather than an in-memory database, which locks whole tables,
+        # so that concurrent tests can write from multiple threads
+        "TEST": {"NAME": "test-example.sqlite"},
+    },
+    "replica": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": "example.sqlite",
+        "TEST": {"MIRROR": "default"},
+    },
 }
 
 